@@ -1,4 +1,5 @@
 import socket
+from RxP.Packeter import Packeter
 from RxP.rxpsocket import rxpsocket
 from exception import RxPException
 
@@ -78,6 +79,31 @@ class sock:
             else:
                 raise
 
+    def sendall(self, dataBytes):
+        try:
+            return self.__s.sendall(dataBytes)
+        except OSError as err:
+            if int(err.winerror) == 10057:
+                raise RxPException(102)
+            elif int(err.winerror) == 10038:
+                raise RxPException(103)
+            elif int(err.winerror) == 10054:
+                raise RxPException(107)
+            else:
+                raise
+
+    def setblocking(self, flag):
+        if RXP:
+            self.__s.set_blocking(flag)
+        else:
+            self.__s.setblocking(flag)
+
+    def setnodelay(self, flag):
+        if RXP:
+            self.__s.set_nodelay(flag)
+        else:
+            self.__s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, flag)
+
     def recv(self, maxBytesRead):
         try:
             return self.__s.recv(maxBytesRead)
@@ -87,9 +113,22 @@ class sock:
             else:
                 raise
 
+    def recv_into(self, buffer, nbytes=0):
+        try:
+            return self.__s.recv_into(buffer, nbytes)
+        except OSError as err:
+            if int(err.winerror) == 10054:
+                raise RxPException(107)
+            else:
+                raise
+
     # set receive buffer size to x segment
     def set_buffer_size(self, x):
-        pass
+        if RXP:
+            self.__s.set_recv_window(x)
+        else:
+            self.__s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                x * Packeter.MSS)
 
     def close(self):
         try:
@@ -87,7 +87,7 @@ class Util(object):
         bytetotalsent = int(0)
 
         while bytetotalsent < filesize:
-            dataread = filehandle.read(10240)
+            dataread = memoryview(filehandle.read(10240))
             bytesent = int(0)
             byteread = len(dataread)
             cls.__util_logger.debug('read ' + str(byteread) + ' bytes')
@@ -143,7 +143,7 @@ class Util(object):
         sent = int(0)
         msg += '\n'
         cls.__util_logger.debug('sending ' + msg)
-        msg = msg.encode(cls.TEXT_ENCODING)
+        msg = memoryview(msg.encode(cls.TEXT_ENCODING))
         msglen = len(msg)
         while sent < msglen:
             sent += socket.send(msg[sent:])
@@ -0,0 +1,79 @@
+import zlib
+
+from FxA.util import Util
+
+
+class Compressor:
+    """ Per connection data compression, negotiated during YO! exchange.
+    Every segment is compressed on its own so it can be decompressed no
+    matter which other segments were lost. Compression is bypassed for a
+    while when recent segments did not get smaller, e.g. when the data
+    being sent is already compressed.
+    """
+    __logger = Util.setup_logger()
+
+    # compression method ids, as carried in the OPT_COMPRESS option
+    ZLIB = 1
+
+    LEVEL = 1
+    # segments smaller than this are not worth compressing
+    MIN_SIZE = 128
+    # compressed/original size ratio above which compression is bypassed
+    POOR_RATIO = 0.9
+    # weight of the latest segment in the average ratio
+    RATIO_WEIGHT = 0.25
+    # number of segments sent as is before compression is tried again
+    BYPASS_SEGMENTS = 64
+
+    def __init__(self, method=ZLIB):
+        self.__method = method
+        self.__ratio = 0
+        self.__bypass = 0
+
+    def get_method(self):
+        return self.__method
+
+    def get_ratio(self):
+        """ Average compressed/original size ratio of recent segments
+        :return: the ratio
+        """
+        return self.__ratio
+
+    def deflate(self, data):
+        """ Compresses the data of a segment
+        :param data: the data
+        :return: the compressed data, None if the data should be sent as is
+        """
+        if len(data) < self.MIN_SIZE:
+            return None
+        if self.__bypass > 0:
+            self.__bypass -= 1
+            return None
+        zipped = zlib.compress(data, self.LEVEL)
+        ratio = len(zipped) / len(data)
+        self.__ratio += self.RATIO_WEIGHT * (ratio - self.__ratio)
+        if self.__ratio > self.POOR_RATIO:
+            self.__logger.info("COMPRESSION bypassed, ratio %.2f" %
+                               self.__ratio)
+            self.__bypass = self.BYPASS_SEGMENTS
+            # start over when we try again
+            self.__ratio = 0
+        if len(zipped) >= len(data):
+            return None
+        return zipped
+
+    @classmethod
+    def inflate(cls, data, max_size):
+        """ Decompresses the data of a segment
+        :param data: the compressed data
+        :param max_size: the maximum size of the original data
+        :return: the original data, None if data is not valid or too large
+        """
+        inflater = zlib.decompressobj()
+        try:
+            original = inflater.decompress(data, max_size)
+        except zlib.error:
+            return None
+        if inflater.unconsumed_tail or not inflater.eof:
+            return None
+        return original
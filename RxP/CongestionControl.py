@@ -1,33 +1,106 @@
-from RxP.Packeter import Packeter
+import abc
+
 from FxA.util import Util
 
-class CongestionControl:
 
+class CongestionControl(abc.ABC):
+    """ Congestion window of one connection, in bytes.
+    The send path reports ACKs, RTT samples and losses, subclasses decide
+    how the window grows and how much it shrinks on a loss. Below the slow
+    start threshold every subclass grows the window by the bytes acked, at
+    most one MSS per ACK. Fast recovery follows NewReno (RFC 6582).
+    """
     __logger = Util.setup_logger()
-    __congestion_window = 1  # segment
-    __state = True  # True = slow start, False = congestion avoidance
-    __threshold = 0
 
+    # in segments (RFC 6928)
+    INITIAL_WINDOW = 10
+    MIN_WINDOW = 2
+
+    def __init__(self, mss):
+        """ Creates a congestion controller for a new connection
+        :param mss: the MSS of the connection
+        :return: None
+        """
+        self._mss = mss
+        self._congestion_window = self.INITIAL_WINDOW * mss
+        self._threshold = float('inf')
+
+    def get_congestion_window(self):
+        return int(self._congestion_window)
 
-    @classmethod
-    def got_new_ack(cls):
-        if cls.__state:
-            cls.__congestion_window += Packeter.MSS
+    def is_slow_start(self):
+        return self._congestion_window < self._threshold
+
+    def on_ack(self, acked):
+        """ New data was acked
+        :param acked: the number of bytes acked
+        :return: None
+        """
+        if self.is_slow_start():
+            self._congestion_window += min(acked, self._mss)
         else:
-            cls.__congestion_window += (Packeter.MSS * Packeter.MSS)/cls.__congestion_window
-        cls.__update_state()
-        cls.__logger.info("CONG_CTRL got new ack")
-
-    @classmethod
-    def report_missing_packet(cls):
-        cls.__threshold = cls.__congestion_window/2
-        cls.__congestion_window = 1
-        cls.__update_state()
-        # cls.__state = True TODO: which one makes more sense?
-        cls.__logger.info("CONG_CTRL got new missing packet report")
-
-    @classmethod
-    def __update_state(cls):
-        cls.__state = (cls.__congestion_window <= cls.__threshold)
-        cls.__logger.info("CONG_CTRL state changed to: %s" % "Slow Start" if cls.__state else "Congestion Avoidance")
-        # TODO: dont forget to send 1byte data if peer receive windows is full
\ No newline at end of file
+            self._avoid_congestion(acked)
+
+    def on_rtt_sample(self, sample_rtt):
+        """ An RTT was measured
+        :param sample_rtt: the RTT in seconds
+        :return: None
+        """
+        pass
+
+    def on_timeout(self, in_flight):
+        """ The retransmission timer expired, start over from one segment
+        :param in_flight: the number of bytes in flight
+        :return: None
+        """
+        self._reduce(in_flight)
+        self._congestion_window = self._mss
+        self.__logger.info("CONG_CTRL timeout, threshold: %d",
+                           self._threshold)
+
+    def on_loss(self, in_flight):
+        """ The third duplicate ACK started fast recovery. The window is
+        inflated by the three segments that left the network
+        :param in_flight: the number of bytes in flight
+        :return: None
+        """
+        self._reduce(in_flight)
+        self._congestion_window = self._threshold + 3 * self._mss
+        self.__logger.info("CONG_CTRL fast retransmit, threshold: %d",
+                           self._threshold)
+
+    def on_dup_ack(self):
+        """ One more duplicate ACK during fast recovery, one more segment
+        left the network
+        :return: None
+        """
+        self._congestion_window += self._mss
+
+    def on_partial_ack(self, acked):
+        """ An ACK during fast recovery that does not cover all the data
+        sent before the loss. The window is deflated by what was acked
+        :param acked: the number of bytes acked
+        :return: None
+        """
+        self._congestion_window = max(
+            self._congestion_window - acked + self._mss, self._mss)
+
+    def on_recovery_exit(self):
+        """ Everything sent before the loss is acked
+        :return: None
+        """
+        self._congestion_window = self._threshold
+
+    def _reduce(self, in_flight):
+        """ Sets the slow start threshold after a loss
+        :param in_flight: the number of bytes in flight
+        :return: None
+        """
+        self._threshold = max(in_flight / 2, self.MIN_WINDOW * self._mss)
+
+    @abc.abstractmethod
+    def _avoid_congestion(self, acked):
+        """ Grows the window past the slow start threshold
+        :param acked: the number of bytes acked
+        :return: None
+        """
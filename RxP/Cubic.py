@@ -0,0 +1,69 @@
+import time
+
+from RxP.CongestionControl import CongestionControl
+
+
+class Cubic(CongestionControl):
+    """ CUBIC congestion avoidance (RFC 9438): past the slow start threshold
+    the window follows a cubic function of the time since the last
+    reduction, centered on the window the loss happened at. It never grows
+    slower than Reno would.
+    """
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss):
+        super().__init__(mss)
+        # the window, in segments, at the last reduction
+        self.__max_window = 0
+        self.__epoch_start = None
+        self.__origin = 0
+        self.__k = 0
+        # the window Reno would have, in segments
+        self.__reno_window = 0
+        self.__min_rtt = None
+
+    def on_rtt_sample(self, sample_rtt):
+        if self.__min_rtt is None or sample_rtt < self.__min_rtt:
+            self.__min_rtt = sample_rtt
+
+    def _reduce(self, in_flight):
+        """ Multiplicative decrease on loss, remembering where it happened
+        :param in_flight: the number of bytes in flight
+        :return: None
+        """
+        window = self._congestion_window / self._mss
+        if window < self.__max_window:
+            # fast convergence, give way to newer flows
+            self.__max_window = window * (1 + self.BETA) / 2
+        else:
+            self.__max_window = window
+        self.__epoch_start = None
+        self._threshold = max(self._congestion_window * self.BETA,
+                              self.MIN_WINDOW * self._mss)
+
+    def _avoid_congestion(self, acked):
+        now = time.monotonic()
+        window = self._congestion_window / self._mss
+        segments = min(acked, self._mss) / self._mss
+        if self.__epoch_start is None:
+            self.__epoch_start = now
+            self.__reno_window = window
+            if window < self.__max_window:
+                self.__k = ((self.__max_window - window) / self.C) ** (1 / 3)
+                self.__origin = self.__max_window
+            else:
+                self.__k = 0
+                self.__origin = window
+        # aim for the window one RTT from now
+        elapsed = now - self.__epoch_start + (self.__min_rtt or 0)
+        target = self.__origin + self.C * (elapsed - self.__k) ** 3
+        target = min(target, 1.5 * window)
+        self.__reno_window += 3 * (1 - self.BETA) / (1 + self.BETA) * \
+            segments / window
+        target = max(target, self.__reno_window)
+        if target > window:
+            window += (target - window) / window * segments
+        else:
+            window += 0.01 * segments / window
+        self._congestion_window = window * self._mss
@@ -0,0 +1,88 @@
+import queue
+import threading
+
+from FxA.util import Util
+
+
+class Dispatcher:
+    """ Runs tasks on a fixed set of worker threads, each with a bounded
+    queue. Tasks submitted with the same key run on the same worker in the
+    order they were submitted, so a task that blocks only holds up the keys
+    that share its worker. A task that finds its queue full, in tasks or in
+    the bytes the queued tasks hold on to, is refused rather than blocking
+    the caller.
+    """
+    __logger = Util.setup_logger()
+
+    def __init__(self, workers=8, depth=64, max_bytes=None):
+        """ Creates a new dispatcher, the workers start with the first task
+        :param workers: the number of worker threads
+        :param depth: the most tasks waiting in the queue of a worker
+        :param max_bytes: the most bytes the tasks of a worker may hold on
+        to until they ran, None for no limit
+        :return: None
+        """
+        self.__queues = [queue.Queue(maxsize=depth) for _ in range(workers)]
+        self.__max_bytes = max_bytes
+        # bytes held by the tasks of each worker that did not run yet
+        self.__pending = [0] * workers
+        self.__pending_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        self.__started = False
+        self.__refused = 0
+
+    def submit(self, key, task, size=0):
+        """ Queues a task on the worker of its key
+        :param key: a hashable key, such as the connection the task is for
+        :param task: function with no param
+        :param size: the bytes the task holds on to until it ran. A task
+        larger than max_bytes is still queued on an idle worker
+        :return: True if the task was queued, False if the queue was full
+        """
+        if not self.__started:
+            self.__start()
+        worker = hash(key) % len(self.__queues)
+        with self.__pending_lock:
+            pending = self.__pending[worker]
+            if self.__max_bytes is not None and pending and \
+                    pending + size > self.__max_bytes:
+                self.__refused += 1
+                return False
+            self.__pending[worker] = pending + size
+        try:
+            self.__queues[worker].put_nowait((task, size))
+        except queue.Full:
+            with self.__pending_lock:
+                self.__pending[worker] -= size
+                self.__refused += 1
+            return False
+        return True
+
+    def get_stats(self):
+        return {
+            'queued': sum(tasks.qsize() for tasks in self.__queues),
+            'pending_bytes': sum(self.__pending),
+            'refused': self.__refused
+        }
+
+    def __start(self):
+        with self.__lock:
+            if self.__started:
+                return
+            for i in range(len(self.__queues)):
+                threading.Thread(target=self.__work, args=(i,),
+                                 name='rxp-worker-%d' % i,
+                                 daemon=True).start()
+            self.__started = True
+
+    def __work(self, worker):
+        tasks = self.__queues[worker]
+        while True:
+            task, size = tasks.get()
+            try:
+                task()
+            except Exception:
+                self.__logger.exception("Dispatched task failed")
+            finally:
+                with self.__pending_lock:
+                    self.__pending[worker] -= size
@@ -0,0 +1,11 @@
+from RxP.CongestionControl import CongestionControl
+
+
+class NewReno(CongestionControl):
+    """ Reno congestion avoidance (RFC 5681): the window grows by about one
+    MSS per RTT past the slow start threshold.
+    """
+
+    def _avoid_congestion(self, acked):
+        self._congestion_window += \
+            self._mss * min(acked, self._mss) / self._congestion_window
@@ -1,11 +1,15 @@
 class Packet:
+    # a packet is allocated for every segment sent or received, keep it small
+    __slots__ = ('__src_port', '__dst_port', '__seq_num', '__ack_num',
+                 '__recv_window_size', '__checksum', '__yo', '__cya',
+                 '__ack', '__zip', '__options', '__data', '__raw',
+                 '__data_offset')
 
     def __init__(self, src_port=0, dst_port=0, seq_num=0, data=None):
         if not data:
-            data = []
-        elif type(data) is not type([]):
-            data = list(data)
-
+            data = b''
+        elif not isinstance(data, (bytes, memoryview)):
+            data = bytes(data)
 
         self.__src_port = src_port
         self.__dst_port = dst_port
@@ -18,12 +22,23 @@ class Packet:
         self.__yo = False
         self.__cya = False
         self.__ack = False
+        self.__zip = False
 
-        self.__data = data
+        # header options, option kind -> value
+        self.__options = None
 
-    def _copy(self, src, dst, seq, ack, wind, chk, cyo, ccya, cack, data):
+        self.__data = data
+        self.__raw = None
+        self.__data_offset = 0
+
+    def _copy(self, src, dst, seq, ack, wind, chk, cyo, ccya, cack, data=None,
+              raw=None, offset=0, czip=False, options=None):
+        """ Fills the packet in place. When raw is given, the data is the
+        part of raw starting at offset, but it is not sliced until someone
+        asks for it
+        """
         if not data:
-            data = []
+            data = b''
         self.__src_port = src
         self.__dst_port = dst
         self.__seq_num = seq
@@ -35,31 +50,42 @@ class Packet:
         self.__yo = cyo
         self.__cya = ccya
         self.__ack = cack
+        self.__zip = czip
+
+        self.__options = options
 
         self.__data = data
+        self.__raw = raw
+        self.__data_offset = offset
 
-    def _stringify(self):
-        st = ''
-        st += '<src>' + str(self.__src_port) + '</src>'
-        st += '<dst>' + str(self.__dst_port) + '</dst>'
-        st += '<seq>' + str(self.__seq_num) + '</seq>'
-        st += '<ack>' + str(self.__ack_num) + '</ack>'
-        st += '<wind>' + str(self.__recv_window_size) + '</wind>'
-        st += '<chk>' + str(self.__checksum) + '</chk>'
-        st += '<cyo>' + str(self.__yo) + '</cyo>'
-        st += '<ccya>' + str(self.__cya) + '</ccya>'
-        st += '<cack>' + str(self.__ack) + '</cack>'
-        st += '<data>' + str(self.__data)
-        i = int(0)
-        for data in self.__data:
-            st += '<' + str(i) + '>' + str(data) + '</' + str(i) + '>'
-            i += 1
-        st += '</data>'
-        return st
+    def _reset(self):
+        """ Clears the packet so it can be reused and does not keep its data
+        alive
+        """
+        self._copy(0, 0, 0, 0, 0, 0, False, False, False)
 
     def get_data(self):
+        if self.__raw is not None:
+            self.__data = memoryview(self.__raw)[self.__data_offset:]
+            self.__raw = None
         return self.__data
 
+    def set_data(self, data):
+        self.__data = data
+        self.__raw = None
+
+    def get_options(self):
+        return self.__options or {}
+
+    def set_options(self, options):
+        self.__options = options
+
+    def set_compressed(self, compressed=True):
+        self.__zip = compressed
+
+    def is_compressed(self):
+        return self.__zip
+
     def get_dst_port(self):
         return self.__dst_port
 
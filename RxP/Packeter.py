@@ -1,8 +1,6 @@
-import re
+import struct
 
 from FxA.util import Util
-import io
-import pickle
 from RxP.Packet import Packet
 
 __author__ = 'Lovissa Winyoto'
@@ -10,33 +8,80 @@ __author__ = 'Lovissa Winyoto'
 
 class Packeter:
     __logger = Util.setup_logger()
-    MSS = 1024  # in bytes
+    MSS = 1024  # in bytes, used until the peers agree on one
+    MIN_MSS = 64
+
+    # wire format version, version 1 was the text based format
+    VERSION = 2
+
+    # version, flags, src port, dst port, seq num, ack num, window size,
+    # checksum, data length
+    HEADER = struct.Struct('!BBHHIIIHH')
+
+    # largest UDP payload, and the largest MSS that still leaves room for
+    # the header and the largest options block in a datagram
+    MAX_DATAGRAM = 65507
+    MAX_MSS = MAX_DATAGRAM - HEADER.size - 256
+    __PORTS = struct.Struct('!HH')  # src port, dst port at offset 2
+    __LENGTH = struct.Struct('!H')  # data length, last header field
+
+    FLAG_YO = 0x01
+    FLAG_CYA = 0x02
+    FLAG_ACK = 0x04
+    FLAG_OPT = 0x08  # an options block follows the header
+    FLAG_ZIP = 0x10  # the data is compressed
+    FLAG_MASK = FLAG_YO | FLAG_CYA | FLAG_ACK | FLAG_OPT | FLAG_ZIP
+
+    # The options block starts with its own length in bytes (itself
+    # included, always even), followed by kind, length, value options and
+    # zero padding. Options of unknown kind are skipped.
+    OPT_END = 0
+    OPT_MSS = 1  # MSS offered or agreed on in YO!
+    OPT_COMPRESS = 2  # compression method offered or agreed on in YO!
+    OPT_SACK = 3  # (start, end) seq num ranges received out of order
+    MAX_SACK_BLOCKS = 4
+    __SACK_BLOCK = struct.Struct('!II')
+    __OPTION_FORMATS = {
+        OPT_MSS: struct.Struct('!H'),
+        OPT_COMPRESS: struct.Struct('!B')
+    }
+
+    # sequence number space, bounded by the 32 bit seq num header field
+    MAX_SEQ_NUM = 4294967296
 
     @classmethod
-    def packetize(cls, src_port, dst_port, seq_num, data):
+    def packetize(cls, src_port, dst_port, seq_num, data, compressor=None,
+                  mss=None):
         """ Breaks down data into packets. The input data is already in binary.
-        This method breaks the binary to 544 bytesdef.
+        This method breaks the binary to MSS bytes segments without copying
+        the data.
         :param src_port: the source port of the new packet
         :param dst_port: the destination port of the new packet
         :param seq_num: the sequence number of the new packet
         :param data: the data needs to be packetized
+        :param compressor: the compressor of the connection, None if data is
+        sent as is. Sequence numbers always count the uncompressed data
+        :param mss: the MSS of the connection, None for the default MSS
         :return: the packets that contain the data
         """
+        mss = mss or cls.MSS
         packet_list = []
         if data:
-            leftover = len(data)
-            start = 0
-            end = (cls.MSS if len(data) >= cls.MSS else len(data)) - 1
-            while leftover > 0:
-                new_packet = cls.compute_checksum(
-                    Packet(src_port, dst_port, seq_num, data[start:end+1]))
+            # slices of a memoryview share the caller's buffer
+            data = memoryview(data)
+            for start in range(0, len(data), mss):
+                chunk = data[start:start + mss]
+                zipped = None
+                if compressor is not None:
+                    zipped = compressor.deflate(chunk)
+                new_packet = Packet(src_port, dst_port, seq_num, chunk)
+                if zipped is not None:
+                    new_packet.set_data(zipped)
+                    new_packet.set_compressed()
+                new_packet = cls.compute_checksum(new_packet)
                 packet_list.append(new_packet)
-                seq_num += end
-                leftover -= (end - start + 1)
-                # update the index
-                start = end + 1
-                end += cls.MSS if leftover >= cls.MSS else leftover
-                cls.__logger.info("Packetize: seq_num: %d" % seq_num)
+                seq_num = (seq_num + len(chunk)) % cls.MAX_SEQ_NUM
+                cls.__logger.info("Packetize: seq_num: %d", seq_num)
         else:
             new_packet = cls.compute_checksum(
                 Packet(src_port, dst_port, seq_num))
@@ -54,29 +99,39 @@ class Packeter:
         c = a + b
         return (c & 0xffff) + (c >> 16)
 
+    @classmethod
+    def word_sum(cls, data):
+        """
+        Calculate the one's complement sum of data, read 16 bit at a time.
+        Instead of adding the words one by one, the data is read as a
+        single big number: since 2^16 = 1 (mod 0xffff), the end around
+        carry sum of its words is the number modulo 0xffff, which is done
+        by the interpreter in one pass
+        :param data: the bytes to be summed, odd length is padded with zero
+        :return: the 16 bit one's complement sum
+        """
+        value = int.from_bytes(data, 'big')
+        if len(data) % 2:
+            value <<= 8
+        s = value % 0xffff
+        if s == 0 and value:
+            # one's complement sum of nonzero words is never +0
+            s = 0xffff
+        return s
+
     @classmethod
     def __checksum(cls, packet):
         """
         Calculate a packet's checksum.
-        The method calculates the checksum by binarizing the packet.
-        The binarized packet checksum is zeroed before checksummed.
-        The method calls the __carry_around method to recount the overflow
-        to the checksum
+        The header is binarized with a zeroed checksum and summed together
+        with the data, the packet itself is left untouched.
         :param packet: the packet to be checksummed
         :return: the checksum of the packet
         """
-        orig = packet.get_checksum()
-        packet.set_checksum(0)
-        bytes = cls.binarize(packet)
-        s = 0
-        ptr = 0
-        while ptr < len(bytes):
-            double_byte = bytes[ptr] | (bytes[ptr + 1] << 8) if ptr + 1 < len(
-                bytes) else 0
-            ptr += 2
-            s = cls.__carry_around(s, double_byte)
-        packet.set_checksum(orig)
-        return s
+        return cls.__carry_around(
+            cls.word_sum(cls.__binarize_header(packet, checksum=0)),
+            cls.word_sum(packet.get_data())
+        )
 
     @classmethod
     def __negated_checksum(cls, packet):
@@ -99,14 +154,63 @@ class Packeter:
         :return: the packet with the checksum filled with the checksum
         """
 
-        checksum = cls.__checksum(packet)
+        checksum = cls.__negated_checksum(packet)
         packet.set_checksum(checksum)
-        cls.__logger.info("SET packet checksum: %d" % checksum)
+        cls.__logger.info("SET packet checksum: %d", checksum)
+        return packet
+
+    @classmethod
+    def update_checksum(cls, checksum, old_words, new_words):
+        """
+        Incrementally update a checksum after some 16 bit words of the
+        segment changed, following RFC 1624: HC' = ~(~HC + ~m + m'). A word
+        may also be the one's complement sum of a changed part
+        :param checksum: the checksum before the words changed
+        :param old_words: the words before the change
+        :param new_words: the words after the change
+        :return: the updated checksum
+        """
+        s = ~checksum & 0xffff
+        for old, new in zip(old_words, new_words):
+            s = cls.__carry_around(s, ~old & 0xffff)
+            s = cls.__carry_around(s, new)
+        return ~s & 0xffff
+
+    @classmethod
+    def restamp(cls, packet, ack, ack_num, window_size, sack_blocks=None):
+        """
+        Update the ack, window and SACK fields of a checksummed packet just
+        before it is (re)sent. Only the header is summed again, the checksum
+        is updated incrementally with the old and new header sums, so this
+        costs the same whatever the size of the data is
+        :param packet: the checksummed packet
+        :param ack: True if the ACK bit should be set
+        :param ack_num: the acknowledgement number
+        :param window_size: the receive window size
+        :param sack_blocks: list of (start, end) sequence number ranges
+        received out of order, None or empty if there is none
+        :return: the packet
+        """
+        old_sum = cls.word_sum(cls.__binarize_header(packet, checksum=0))
+        if ack:
+            packet.set_ack(ack_num=ack_num)
+        packet.set_window_size(new_size=window_size)
+        options = packet.get_options()
+        if sack_blocks or cls.OPT_SACK in options:
+            options = dict(options)
+            options.pop(cls.OPT_SACK, None)
+            if sack_blocks:
+                options[cls.OPT_SACK] = sack_blocks
+            packet.set_options(options or None)
+        new_sum = cls.word_sum(cls.__binarize_header(packet, checksum=0))
+        packet.set_checksum(cls.update_checksum(
+            packet.get_checksum(), (old_sum,), (new_sum,)))
         return packet
 
     @classmethod
     def validate_checksum(cls, packet):
         """ Returns whether a packet is good based on checksum validation.
+        The sum of the segment including the checksum has to be all 1's
         The method returns true if the checksum matches (packet is validated)
         The method returns false if the checksum does not match
         :param packet: the packet to be validated
@@ -114,18 +218,13 @@ class Packeter:
         """
         checksum = packet.get_checksum()
         actual_checksum = cls.__checksum(packet)
-        cls.__logger.info(
-            "checksum %d current checksum %d" % (checksum, actual_checksum))
-        cls.__logger.info("VALIDATE checksum: %s" % str((actual_checksum +
-                                                         checksum) & 0xffff
-                                                        == 0xffff))
-        ret = cls.__carry_around(actual_checksum, checksum) & 0xffff == 0xffff
-        assert checksum == packet.get_checksum()
-        return checksum == actual_checksum
+        valid = cls.__carry_around(actual_checksum, checksum) == 0xffff
+        cls.__logger.info("VALIDATE checksum: %s", valid)
+        return valid
 
     @classmethod
     def control_packet(cls, src_port, dst_port, seq_num, ack_num=0, yo=False,
-                       cya=False, ack=False):
+                       cya=False, ack=False, options=None):
         """
         Make a control packet
         :param src_port: the source port of the new packet
@@ -135,9 +234,11 @@ class Packeter:
         :param yo: True if YO packet, False otherwise
         :param cya: True if CYA packet, False otherwise
         :param ack: True if ACK packet, False otherwise
+        :param options: the header options, dict of option kind to value
         :return: return the ready to send packet (checksummed)
         """
         cp = Packet(src_port, dst_port, seq_num, None)
+        cp.set_options(options)
         if yo:
             cp.set_yo()
             cls.__logger.info("CREATED YO packet")
@@ -152,70 +253,204 @@ class Packeter:
     @classmethod
     def binarize(cls, segment):
         """
-        Convert anything to binary
-        :param segment: anything
-        :return: binarized anything
+        Convert a segment to its wire format: a fixed layout header followed
+        by the raw data bytes
+        :param segment: the segment to be converted
+        :return: the binarized segment
         """
-        return segment._stringify().encode('utf-8') #buff.getvalue()
+        return cls.binarize_header(segment) + segment.get_data()
 
     @classmethod
-    def objectize(cls, binary):
+    def binarize_header(cls, segment):
         """
-        Converts binary to anything
-        :param binary: the binary
-        :return: anything
+        Convert the header of a segment to its wire format. The data bytes
+        follow the header as is, so the caller can hand both to the network
+        without joining them
+        :param segment: the segment whose header to be converted
+        :return: the binarized header
         """
-        # loggers = cls.__logger
-        # loggers.info("OBJECTIZE: %d %s" % (len(binary), binary))
-        # ret = pickle.loads(binary)
-        # loggers.debug(ret)
-        return cls._objectify(binary) #ret
+        return cls.__binarize_header(segment, segment.get_checksum())
 
     @classmethod
-    def __print_bin(cls, bin):
+    def __flags(cls, segment):
+        flags = 0
+        if segment.is_yo():
+            flags |= cls.FLAG_YO
+        if segment.is_cya():
+            flags |= cls.FLAG_CYA
+        if segment.is_ack():
+            flags |= cls.FLAG_ACK
+        if segment.get_options():
+            flags |= cls.FLAG_OPT
+        if segment.is_compressed():
+            flags |= cls.FLAG_ZIP
+        return flags
 
-        cls.__logger.debug(str(len(bin)))
-        a = []
-        for byte in bin:
-            a.append("0x{:02x}".format(byte))
-        return ''#a
+    @classmethod
+    def __binarize_header(cls, segment, checksum):
+        return cls.HEADER.pack(
+            cls.VERSION,
+            cls.__flags(segment),
+            segment.get_src_port(),
+            segment.get_dst_port(),
+            segment.get_seq_num(),
+            segment.get_ack_num(),
+            segment.get_window_size(),
+            checksum,
+            len(segment.get_data())
+        ) + cls.__binarize_options(segment.get_options())
 
     @classmethod
-    def _objectify(cls, packet):
-        cls.__logger.info("OBJECTIFY")
-        res = re.match('<src>(.+?)</src><dst>(.+?)</dst><seq>('
-                       '.+?)</seq><ack>(.+?)</ack><wind>(.+?)</wind><chk>('
-                       '.+?)</chk><cyo>(.+?)</cyo><ccya>(.+?)</ccya><cack>('
-                       '.+?)</cack><data>(.+?)</data>', packet.decode('utf-8'))
-        if not res:
-            cls.__logger.info("corrupted object")
-            return Packet()
-        cls.__logger.debug(res.group(0))
-        datalist = res.group(10)
-        i = int(0)
-        done = False
-        data = []
-        while not done:
-            datares = re.search('<' + str(i) + '>(.+?)</' + str(i) + '>',
-                             datalist)
-            if datares:
-                data.append(int(datares.group(1)))
+    def __binarize_options(cls, options):
+        if not options:
+            return b''
+        block = bytearray(1)
+        for kind in sorted(options):
+            if kind == cls.OPT_SACK:
+                value = b''.join(cls.__SACK_BLOCK.pack(start, end) for start,
+                                 end in options[kind][:cls.MAX_SACK_BLOCKS])
             else:
-                done = True
-            i += 1
+                value = cls.__OPTION_FORMATS[kind].pack(options[kind])
+            block.append(kind)
+            block.append(len(value))
+            block += value
+        if len(block) % 2:
+            block.append(cls.OPT_END)
+        block[0] = len(block)
+        return bytes(block)
+
+    @classmethod
+    def __objectize_options(cls, block):
+        """
+        Parses an options block
+        :param block: the options block, including its length byte
+        :return: dict of option kind to value, None if the block is corrupted
+        """
+        options = {}
+        start = 1
+        while start + 2 <= len(block):
+            kind = block[start]
+            if kind == cls.OPT_END:
+                break
+            end = start + 2 + block[start + 1]
+            if end > len(block):
+                return None
+            option_format = cls.__OPTION_FORMATS.get(kind)
+            if kind == cls.OPT_SACK:
+                if (end - start - 2) % cls.__SACK_BLOCK.size:
+                    return None
+                options[kind] = list(cls.__SACK_BLOCK.iter_unpack(
+                    block[start + 2:end]))
+            elif option_format is not None:
+                if option_format.size != end - start - 2:
+                    return None
+                options[kind] = option_format.unpack_from(
+                    block, start + 2)[0]
+            start = end
+        return options
+
+    @classmethod
+    def __options_size(cls, binary, start, flags):
+        """
+        The size of the options block of the segment starting at start
+        :return: the size, None if it can not be a valid options block
+        """
+        if not flags & cls.FLAG_OPT:
+            return 0
+        at = start + cls.HEADER.size
+        if at >= len(binary) or binary[at] < 2 or binary[at] % 2:
+            return None
+        return binary[at]
+
+    @classmethod
+    def peek_ports(cls, binary):
+        """
+        Reads only the ports of a binarized segment, which is all that is
+        needed to find the socket that owns it
+        :param binary: the binary
+        :return: tuple of source and destination port, None if the binary is
+        too short to be a segment
+        """
+        if len(binary) < cls.HEADER.size:
+            return None
+        return cls.__PORTS.unpack_from(binary, 2)
+
+    @classmethod
+    def split(cls, binary):
+        """
+        Splits a datagram into the binarized segments coalesced in it, using
+        the data length of every header. Trailing bytes that do not make a
+        whole segment are dropped
+        :param binary: the datagram
+        :return: list of views of the binarized segments
+        """
+        binary = memoryview(binary)
+        header_size = cls.HEADER.size
+        segments = []
+        start = 0
+        while start + header_size <= len(binary):
+            length = cls.__LENGTH.unpack_from(
+                binary, start + header_size - cls.__LENGTH.size)[0]
+            options_size = cls.__options_size(binary, start, binary[start + 1])
+            if options_size is None:
+                cls.__logger.info("corrupted object")
+                break
+            end = start + header_size + options_size + length
+            if end > len(binary):
+                cls.__logger.info("corrupted object")
+                break
+            segments.append(binary[start:end])
+            start = end
+        return segments
 
-        pack = Packet()
+    @classmethod
+    def objectize(cls, binary, pool=None):
+        """
+        Converts wire format back to a segment
+        :param binary: the binary
+        :param pool: the pool to take the packet from, None to allocate a
+        new packet
+        :return: the segment, None if the binary is not a valid segment
+        """
+        header_size = cls.HEADER.size
+        if len(binary) < header_size:
+            cls.__logger.info("corrupted object")
+            return None
+        if binary[0] != cls.VERSION:
+            # peers with different version can not talk to us, this is
+            # how an old stack is detected during YO! exchange
+            cls.__logger.warning(
+                "DROPPED segment of incompatible RxP version %d" % binary[0])
+            return None
+        version, flags, src, dst, seq, ack, wind, chk, length = \
+            cls.HEADER.unpack_from(binary)
+        options_size = cls.__options_size(binary, 0, flags)
+        if options_size is None or flags & ~cls.FLAG_MASK or \
+                header_size + options_size + length != len(binary):
+            cls.__logger.info("corrupted object")
+            return None
+        options = None
+        if options_size:
+            options = cls.__objectize_options(
+                binary[header_size:header_size + options_size])
+            if options is None:
+                cls.__logger.info("corrupted object")
+                return None
+        # the data is left in the received datagram until it is needed
+        pack = Packet() if pool is None else pool.acquire()
         pack._copy(
-            src=int(res.group(1)),
-            dst=int(res.group(2)),
-            seq=int(res.group(3)),
-            ack=int(res.group(4)),
-            wind=int(res.group(5)),
-            chk=int(res.group(6)),
-            cyo=True if res.group(7) == 'True' else False,
-            ccya=True if res.group(8) == 'True' else False,
-            cack=True if res.group(9) == 'True' else False,
-            data=data
+            src=src,
+            dst=dst,
+            seq=seq,
+            ack=ack,
+            wind=wind,
+            chk=chk,
+            cyo=bool(flags & cls.FLAG_YO),
+            ccya=bool(flags & cls.FLAG_CYA),
+            cack=bool(flags & cls.FLAG_ACK),
+            raw=binary,
+            offset=header_size + options_size,
+            czip=bool(flags & cls.FLAG_ZIP),
+            options=options
         )
-        cls.__logger.info("OBJ done")
         return pack
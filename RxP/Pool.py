@@ -0,0 +1,70 @@
+import collections
+import threading
+
+
+class Pool:
+    """ Bounded free list of reusable objects.
+    Objects released beyond the capacity are left to the garbage collector.
+    """
+
+    def __init__(self, factory, capacity, reset=None):
+        """ Creates a new pool
+        :param factory: function with no param that makes a new object
+        :param capacity: the maximum number of free objects kept
+        :param reset: function called with an object when it is released
+        :return: None
+        """
+        self.__factory = factory
+        self.__reset = reset
+        self.__free = collections.deque()
+        self.__capacity = capacity
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__discards = 0
+
+    def acquire(self):
+        """ Takes an object from the pool, makes a new one if it is empty
+        :return: the object
+        """
+        self.__lock.acquire()
+        if self.__free:
+            obj = self.__free.pop()
+            self.__hits += 1
+        else:
+            obj = None
+            self.__misses += 1
+        self.__lock.release()
+        if obj is None:
+            obj = self.__factory()
+        return obj
+
+    def release(self, obj):
+        """ Returns an object to the pool, the caller must not use it after
+        :param obj: the object
+        :return: None
+        """
+        if self.__reset is not None:
+            self.__reset(obj)
+        self.__lock.acquire()
+        if len(self.__free) < self.__capacity:
+            self.__free.append(obj)
+        else:
+            self.__discards += 1
+        self.__lock.release()
+
+    def get_hit_rate(self):
+        """ Fraction of acquire calls served from the pool
+        :return: the hit rate, 0 if nothing was acquired yet
+        """
+        total = self.__hits + self.__misses
+        return self.__hits / total if total else 0
+
+    def get_stats(self):
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'discards': self.__discards,
+            'free': len(self.__free),
+            'hit_rate': self.get_hit_rate()
+        }
@@ -1,21 +1,57 @@
 
 class RTOEstimator:
-    __rto           = 10 #TODO: change this
-    __estimated_rtt = 0
-    __dev_rtt = 0
+    """ Retransmission timeout of one connection, estimated from its RTT
+    samples the Jacobson/Karels way (RFC 6298). All times are in seconds.
+    """
+    INITIAL_RTO = 1.0
+    MIN_RTO = 0.2
+    MAX_RTO = 60.0
+    # granularity of the timers the RTO is armed on
+    CLOCK_GRANULARITY = 0.01
 
-    @classmethod
-    def get_rto_interval(cls):
-        return cls.__rto
+    def __init__(self):
+        self.__rto = self.INITIAL_RTO
+        self.__estimated_rtt = None
+        self.__dev_rtt = 0
+        # times the timer expired since the last new ACK
+        self.__backoff = 0
 
-    # TODO: need a way to measure RTT
-    @classmethod
-    def update_rto_interval(cls, sample_rtt):
-        cls.__estimated_rtt = cls.__estimated_rtt * 0.875 + 0.125 * sample_rtt
-        cls.__dev_rtt = cls.__dev_rtt * 0.75 + 0.25 * abs(sample_rtt -
-                                                          cls.__estimated_rtt)
-        cls.__rto = cls.__estimated_rtt + 4 * cls.__dev_rtt
+    def get_rto_interval(self):
+        return min(self.__rto * (2 ** self.__backoff), self.MAX_RTO)
 
-    @classmethod
-    def rt_update(cls):
-        cls.__rto *= 2
+    def get_estimated_rtt(self):
+        """ The smoothed RTT
+        :return: the smoothed RTT, None before the first sample
+        """
+        return self.__estimated_rtt
+
+    def update_rto_interval(self, sample_rtt):
+        """ Takes an RTT sample in. Following Karn's rule, the sample must
+        come from a segment that was not retransmitted
+        :param sample_rtt: time from sending a segment to its ACK
+        :return: None
+        """
+        if self.__estimated_rtt is None:
+            self.__estimated_rtt = sample_rtt
+            self.__dev_rtt = sample_rtt / 2
+        else:
+            self.__dev_rtt = self.__dev_rtt * 0.75 + 0.25 * abs(
+                sample_rtt - self.__estimated_rtt)
+            self.__estimated_rtt = self.__estimated_rtt * 0.875 + \
+                0.125 * sample_rtt
+        rto = self.__estimated_rtt + max(self.CLOCK_GRANULARITY,
+                                         4 * self.__dev_rtt)
+        self.__rto = min(max(rto, self.MIN_RTO), self.MAX_RTO)
+
+    def rt_update(self):
+        """ Backs the timeout off exponentially when the timer expires
+        :return: None
+        """
+        if self.get_rto_interval() < self.MAX_RTO:
+            self.__backoff += 1
+
+    def reset_backoff(self):
+        """ Drops the backoff once new data is acked
+        :return: None
+        """
+        self.__backoff = 0
@@ -1,35 +1,92 @@
+import bisect
 import collections
 import threading
+import time
 from FxA.util import Util
-# All Units of size are in segments!!!
 from RxP import rxpsocket
 from RxP.Packeter import Packeter
 
 
 class RecvBuffer:
+    """ The window starts at INITIAL_WINDOW_SEGMENTS and grows to twice
+    what the application read in the last RTT, so a sender is never held
+    back by the window while the application keeps up. The RTT is measured
+    by the receiver itself: the time it takes the peer to fill a window
+    once it was advertised. Windows grow up to a per buffer cap, and only
+    while the windows of all buffers add up to less than MEMORY_PRESSURE
+    bytes. Beyond that, windows shrink back to what they hold as the
+    application reads.
+    """
     __logger = Util.setup_logger()
 
+    INITIAL_WINDOW_SEGMENTS = 64
+    MAX_WINDOW_SEGMENTS = 32768
+    MEMORY_PRESSURE = 256 * 1024 * 1024
+
+    # bytes all receive windows add up to
+    __reserved = 0
+    __reserved_lock = threading.Lock()
+
     def __init__(self):
         """ Creates a new receive buffer
         :return: None
         """
-        class_lock = threading.Lock()
-        self.__empty_cond = threading.Condition(class_lock)
-        self.__resize_cond = threading.Condition(class_lock)
-        self.__recv_buffer = collections.deque(maxlen=1)
+        self.__empty_cond = threading.Condition(threading.Lock())
+        # chunks of data bytes, in stream order, and how much of the front
+        # chunk was read already
+        self.__recv_buffer = collections.deque()
+        self.__front_offset = 0
+        # number of bytes held in the chunks, how many it may hold now, and
+        # how many it may grow to
+        self.__size = 0
+        self.__capacity = 1
+        self.__max_capacity = 1
+        # the part of the capacity counted in the bytes all windows add up
+        # to, nothing until the window is opened
+        self.__reserved_capacity = 0
+        # the receiver's RTT estimate, and the offset whose arrival ends
+        # the current measurement, with the time it started
+        self.__rtt = None
+        self.__rtt_mark = None
+        self.__rtt_mark_time = 0
+        # bytes the application read since the window was last tuned
+        self.__copied = 0
+        self.__copied_since = time.monotonic()
         self.__next_ack_num = 0
+        # stream offset of the next expected byte, it does not wrap
+        self.__next_offset = 0
+        # data that arrived ahead of the expected byte, as non overlapping
+        # chunks sorted by the stream offset they start at
+        self.__held_starts = []
+        self.__held_chunks = []
+        self.__mss = Packeter.MSS
         self.__logger.info(
-            "Receive Buffer has been created. Size: %d" %
-            self.__recv_buffer.maxlen)
-
-    def commit(self, buffer_size=32768):
-        buffer_size *= Packeter.MSS
-        self.__resize_cond.acquire()
-        self.__recv_buffer = collections.deque(
-            maxlen=buffer_size,
-            iterable=self.__recv_buffer
-        )
-        self.__resize_cond.release()
+            "Receive Buffer has been created. Size: %d" % self.__capacity)
+
+    def set_mss(self, mss):
+        self.__mss = mss
+
+    def commit(self, max_size=None):
+        """ Opens the window once the connection is established
+        :param max_size: the most bytes the window may grow to, None for
+        MAX_WINDOW_SEGMENTS maximum sized segments
+        :return: None
+        """
+        self.__empty_cond.acquire()
+        if max_size is None:
+            max_size = self.MAX_WINDOW_SEGMENTS * self.__mss
+        self.__max_capacity = max(max_size, 1)
+        self.__resize(min(self.INITIAL_WINDOW_SEGMENTS * self.__mss,
+                          self.__max_capacity))
+        self.__empty_cond.release()
+
+    def release(self):
+        """ Gives the window back once the connection is closed
+        :return: None
+        """
+        self.__empty_cond.acquire()
+        self.__resize(0)
+        self.__empty_cond.release()
 
     def sync_ack_num(self, first_seq_num):
         self.__next_ack_num = first_seq_num
@@ -42,82 +99,294 @@ class RecvBuffer:
         """ Get the size of the buffer
         :return: The size of the buffer
         """
-        return min(self.__recv_buffer.maxlen, 2147483647)
+        return min(self.__capacity, 2147483647)
 
-    def set_buffer_size(self, size_in_segment):
-        """ Sets the size of the buffer
-        :param size_in_segment: the desired size of the buffer
+    def set_max_size(self, max_size):
+        """ Caps the window. A window above the cap shrinks to it at once,
+        data that arrives past it is dropped and resent by the peer
+        :param max_size: the most bytes the window may grow to, None for
+        MAX_WINDOW_SEGMENTS maximum sized segments
         :return: None
         """
-        size_in_segment *= Packeter.MSS
-        self.__resize_cond.acquire()
-        self.__resize_cond.wait_for(len(self.__recv_buffer) < size_in_segment)
-        # once the recv buffer contains less segment than requested new size:
-        self.__recv_buffer = collections.deque(
-            iterable=self.__recv_buffer,
-            maxlen=size_in_segment
-        )
-        self.__resize_cond.release()
+        self.__empty_cond.acquire()
+        if max_size is None:
+            max_size = self.MAX_WINDOW_SEGMENTS * self.__mss
+        self.__max_capacity = max(max_size, 1)
+        if self.__capacity > self.__max_capacity:
+            self.__resize(self.__max_capacity)
+        self.__empty_cond.release()
         self.__logger.info(
-            "SET Buffer Size is: %d" % self.__recv_buffer.maxlen)
+            "SET Buffer Size is: %d" % self.__max_capacity)
+
+    def __resize(self, capacity):
+        with RecvBuffer.__reserved_lock:
+            RecvBuffer.__reserved += capacity - self.__reserved_capacity
+        self.__reserved_capacity = capacity
+        self.__capacity = capacity
+
+    @classmethod
+    def get_reserved(cls):
+        """ The bytes all receive windows add up to
+        :return: the number of bytes
+        """
+        return cls.__reserved
 
     def get_window_size(self):
         """ Returns current window size in segment
         :return: the size of the window
         """
-        return self.__recv_buffer.maxlen - len(self.__recv_buffer)
+        return max(self.__capacity - self.__size, 0)
 
     def put(self, inbound_segment):
-        """ Puts a segment into the receive buffer
+        """ Puts a segment into the receive buffer. Data is trimmed to the
+        part that is new and inside the receive window. Data ahead of the
+        expected byte is held until the gap before it is filled, then the
+        whole contiguous run is delivered at once
         :param inbound_segment: the segment to be put
-        :return: the acknowledgement number
+        :return: None
         """
-        buffer = self.__recv_buffer
-        self.__logger.info("Buffer Size: %d" % len(buffer))
+        self.__logger.info("Buffer Size: %d", self.__size)
         self.__empty_cond.acquire()
-        if len(buffer) < buffer.maxlen and self.is_expecting(inbound_segment):
-            if inbound_segment.is_yo() or inbound_segment.is_cya():
+        if inbound_segment.is_yo() or inbound_segment.is_cya():
+            if self.__size < self.__capacity and self.is_expecting(
+                    inbound_segment):
                 self.__increment_next_ack_num()
-            else:
-                data = inbound_segment.get_data()
-                if data:
-                    for byte in data:
-                        buffer.append(byte)
-                    for i in range(0, len(data)):
-                        self.__increment_next_ack_num()
-            self.__logger.info("Buffer Size: %d" % len(buffer))
+        else:
+            data = inbound_segment.get_data()
+            start = self.__next_offset + self.__distance(
+                inbound_segment.get_seq_num())
+            end = min(start + len(data),
+                      self.__next_offset + self.get_window_size())
+            if start < self.__next_offset:
+                # resent data we partly have already
+                data = data[self.__next_offset - start:]
+                start = self.__next_offset
+            if start < end:
+                # the datagram the data lives in is reused once we return,
+                # so keep a copy
+                data = bytes(data[:end - start])
+                if start == self.__next_offset:
+                    self.__append(data)
+                    self.__deliver_held()
+                    self.__measure_rtt()
+                else:
+                    self.__hold(start, data)
+        self.__logger.info("Buffer Size: %d", self.__size)
         self.__empty_cond.notify()
         self.__empty_cond.release()
 
+    def __append(self, data):
+        self.__recv_buffer.append(data)
+        self.__size += len(data)
+        self.__next_offset += len(data)
+        self.__next_ack_num = (self.__next_ack_num + len(
+            data)) % rxpsocket.MAX_SEQ_NUM
+
+    def __hold(self, start, data):
+        """ Holds data that arrived ahead of the expected byte, keeping
+        only the bytes no held chunk covers yet
+        :param start: the stream offset the data starts at
+        :param data: the data bytes
+        :return: None
+        """
+        starts = self.__held_starts
+        chunks = self.__held_chunks
+        end = start + len(data)
+        i = bisect.bisect_right(starts, start)
+        if i > 0:
+            prev_end = starts[i - 1] + len(chunks[i - 1])
+            if prev_end >= end:
+                return
+            if prev_end > start:
+                data = data[prev_end - start:]
+                start = prev_end
+        # drop the chunks the data covers, and cut the data short where it
+        # runs into the next one
+        last = i
+        while last < len(starts) and starts[last] + len(chunks[last]) <= end:
+            last += 1
+        del starts[i:last]
+        del chunks[i:last]
+        if i < len(starts) and starts[i] < end:
+            data = data[:starts[i] - start]
+        starts.insert(i, start)
+        chunks.insert(i, data)
+        self.__logger.info("HELD %d bytes out of order", len(data))
+
+    def __deliver_held(self):
+        """ Delivers the held chunks the expected byte reached
+        :return: None
+        """
+        starts = self.__held_starts
+        chunks = self.__held_chunks
+        delivered = 0
+        while delivered < len(starts) and \
+                starts[delivered] <= self.__next_offset:
+            overlap = self.__next_offset - starts[delivered]
+            if overlap < len(chunks[delivered]):
+                self.__append(chunks[delivered][overlap:])
+            delivered += 1
+        del starts[:delivered]
+        del chunks[:delivered]
+
+    def __measure_rtt(self):
+        """ Samples the RTT each time the peer filled the window that was
+        open when the last sample was taken. This overestimates the RTT
+        while the peer sends less than a window per RTT, so the smaller
+        samples win
+        :return: None
+        """
+        now = time.monotonic()
+        if self.__rtt_mark is not None and \
+                self.__next_offset >= self.__rtt_mark:
+            sample = now - self.__rtt_mark_time
+            if self.__rtt is None or sample < self.__rtt:
+                self.__rtt = sample
+            else:
+                self.__rtt = self.__rtt * 0.875 + sample * 0.125
+            self.__rtt_mark = None
+        if self.__rtt_mark is None:
+            self.__rtt_mark = self.__next_offset + self.get_window_size()
+            self.__rtt_mark_time = now
+
+    def __tune(self, read):
+        """ Resizes the window once per RTT after the application read
+        :param read: the bytes the application just read
+        :return: None
+        """
+        self.__copied += read
+        now = time.monotonic()
+        if self.__rtt is None or now - self.__copied_since < self.__rtt:
+            return
+        target = 2 * self.__copied
+        self.__copied = 0
+        self.__copied_since = now
+        with RecvBuffer.__reserved_lock:
+            under_pressure = RecvBuffer.__reserved >= self.MEMORY_PRESSURE
+        if under_pressure:
+            target = max(self.INITIAL_WINDOW_SEGMENTS * self.__mss,
+                         self.__size)
+            if target < self.__capacity:
+                self.__resize(target)
+                self.__logger.info("SHRUNK window to %d" % target)
+        elif self.__capacity < target and \
+                self.__capacity < self.__max_capacity:
+            self.__resize(min(target, self.__max_capacity))
+            self.__logger.info("GREW window to %d" % self.__capacity)
+
+    def __distance(self, seq_num):
+        """ Serial number distance from the expected byte
+        :param seq_num: a sequence number
+        :return: the distance in bytes, negative for what is behind it
+        """
+        distance = (seq_num - self.__next_ack_num) % rxpsocket.MAX_SEQ_NUM
+        if distance >= rxpsocket.MAX_SEQ_NUM // 2:
+            distance -= rxpsocket.MAX_SEQ_NUM
+        return distance
+
+    def get_sack_blocks(self):
+        """ The ranges of data received out of order, to be selectively
+        acknowledged
+        :return: list of (start, end) sequence numbers, lowest first
+        """
+        self.__empty_cond.acquire()
+        ranges = []
+        for start, chunk in zip(self.__held_starts, self.__held_chunks):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] += len(chunk)
+            elif len(ranges) < Packeter.MAX_SACK_BLOCKS:
+                ranges.append([start, start + len(chunk)])
+            else:
+                break
+        blocks = [(self.__seq_num(start), self.__seq_num(end))
+                  for start, end in ranges]
+        self.__empty_cond.release()
+        return blocks
+
+    def __seq_num(self, offset):
+        return (self.__next_ack_num + offset - self.__next_offset) % \
+            rxpsocket.MAX_SEQ_NUM
+
     def take(self, max_read):
         """ Takes buffered segment's data.
         :param max_read: the maximum byte stream read
         :return: the list of data bytes with at most max_read long
         """
         data = []
-        buffer = self.__recv_buffer
         self.__empty_cond.acquire()
-        self.__logger.debug('RecvContent: ' + str(self.__recv_buffer))
-        self.__empty_cond.wait_for(lambda: len(buffer) > 0)
-        front = buffer[0]
-        assert len(buffer) > 0
-        while len(buffer) > 0 and len(data) < max_read:
-            if front:
-                data.append(front)
-                buffer.popleft()
-                if len(buffer) > 0:
-                    front = buffer[0]
-        self.__resize_cond.notify()
+        self.__empty_cond.wait_for(lambda: self.__size > 0)
+        read = self.__consume(max_read, data.append)
+        self.__tune(read)
         self.__empty_cond.release()
-        self.__logger.info("TAKE data from receive buffer")
-        self.__logger.debug(str(data))
-        ret = bytearray()
-        for byte in data:
-            ret.append(byte)
-        return ret
+        self.__logger.info("TAKE %d bytes from receive buffer", read)
+        return b''.join(data)
+
+    def take_into(self, buffer):
+        """ Copies buffered data into a caller provided buffer.
+        :param buffer: a writable bytes-like object
+        :return: the number of bytes copied
+        """
+        target = memoryview(buffer).cast('B')
+        self.__empty_cond.acquire()
+        self.__empty_cond.wait_for(lambda: self.__size > 0)
+        read = 0
+
+        def copy(piece):
+            nonlocal read
+            target[read:read + len(piece)] = piece
+            read += len(piece)
+
+        self.__consume(len(target), copy)
+        self.__tune(read)
+        self.__empty_cond.release()
+        self.__logger.info("TAKE %d bytes from receive buffer", read)
+        return read
+
+    def __consume(self, max_read, sink):
+        """ Hands up to max_read bytes from the front of the buffer to
+        sink, as slices of the chunks
+        :param max_read: the maximum number of bytes
+        :param sink: called with each slice, a memoryview
+        :return: the number of bytes consumed
+        """
+        buffer = self.__recv_buffer
+        read = 0
+        while buffer and read < max_read:
+            front = memoryview(buffer[0])[self.__front_offset:]
+            if read + len(front) > max_read:
+                # leave the unread part of the chunk at the front
+                front = front[:max_read - read]
+                self.__front_offset += len(front)
+            else:
+                buffer.popleft()
+                self.__front_offset = 0
+            sink(front)
+            read += len(front)
+        self.__size -= read
+        return read
 
     def __increment_next_ack_num(self):
+        self.__next_offset += 1
         self.__next_ack_num = (self.__next_ack_num + 1) % rxpsocket.MAX_SEQ_NUM
 
     def is_expecting(self, segment):
         return self.__next_ack_num == segment.get_seq_num()
+
+    def has_out_of_order(self):
+        """ Whether data that arrived ahead of a gap is held
+        :return: True if there is a gap to fill
+        """
+        return len(self.__held_starts) > 0
+
+    def is_in_window(self, segment):
+        """ Whether the segment is the expected one, starts ahead of it
+        but inside the receive window, or starts behind it but brings data
+        past it
+        :param segment: the segment
+        :return: True if the segment is in window
+        """
+        offset = (segment.get_seq_num() - self.__next_ack_num) % \
+            rxpsocket.MAX_SEQ_NUM
+        return offset == 0 or offset < self.get_window_size() or \
+            not segment.is_compressed() and \
+            rxpsocket.MAX_SEQ_NUM - offset < len(segment.get_data())
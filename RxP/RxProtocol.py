@@ -1,7 +1,13 @@
+import functools
+import logging
 import socket
 import threading
 from random import randint
+from RxP.Dispatcher import Dispatcher
+from RxP.Packet import Packet
 from RxP.Packeter import Packeter
+from RxP.Pool import Pool
+from RxP.TimerWheel import TimerWheel
 from FxA.util import Util
 from exception import RxPException, NetworkReinitException, InvalidPeerAddress
 
@@ -33,15 +39,69 @@ class RxProtocol:
     # first hop of every segment sent out of this layer
     __proxy_addr = None
 
+    # scatter/gather send is not available on every platform
+    __has_sendmsg = hasattr(socket.socket, 'sendmsg')
+
+    # flag to read without blocking, where the platform has one; without
+    # it every wakeup takes a single datagram
+    __dont_wait = getattr(socket, 'MSG_DONTWAIT', 0)
+
     __dispatch_id = 0
 
     @classmethod
     def __debug_state(cls):
-        cls.__logger.debug("__sockets: " + str(cls.__sockets))
-        cls.__logger.debug("__port_number: " + str(cls.__ports))
-        cls.__logger.debug("__port_to_addr: " + str(cls.__addr_port_pairs))
+        cls.__logger.debug("__sockets: %s", cls.__sockets)
+        cls.__logger.debug("__port_number: %s", cls.__ports)
+        cls.__logger.debug("__port_to_addr: %s", cls.__addr_port_pairs)
+
+    BUFF_SIZE = int(65536)
+
+    # most datagrams read per wakeup of the receive thread
+    MAX_BATCH = 64
+
+    # datagrams up to this size, such as ACKs and segments of the default
+    # MSS, are copied out of their buffer so it goes back to the pool at
+    # once instead of being held until a worker is done with them
+    COPY_SIZE = 4096
+
+    # free lists of received segments and datagram buffers, they go back
+    # once the receiving socket is done with them
+    __segment_pool = Pool(factory=Packet, capacity=4096,
+                          reset=Packet._reset)
+    __buffer_pool = Pool(factory=lambda: bytearray(RxProtocol.BUFF_SIZE),
+                         capacity=64)
 
-    BUFF_SIZE = int(32768)
+    # one driver thread runs the timers of every connection
+    __timers = TimerWheel()
+
+    # connections are processed on worker threads, sharded by connection,
+    # so the receive thread only reads and demultiplexes
+    WORKERS = 8
+    WORKER_QUEUE_DEPTH = 64
+    # the most bytes of received datagrams the batches queued on a worker
+    # hold on to, a batch is dropped beyond it
+    WORKER_QUEUE_BYTES = 4 * 1024 * 1024
+    __dispatcher = Dispatcher(workers=WORKERS, depth=WORKER_QUEUE_DEPTH,
+                              max_bytes=WORKER_QUEUE_BYTES)
+
+    @classmethod
+    def schedule(cls, delay, callback):
+        """ Arms a timer on the shared timer wheel
+        :param delay: seconds until the callback is called
+        :param callback: function with no param, runs on the timer thread
+        :return: the handle to cancel() the timer with
+        """
+        return cls.__timers.schedule(delay, callback)
+
+    @classmethod
+    def get_pool_stats(cls):
+        """ Counters of the segment and datagram buffer pools
+        :return: dict of pool name to its counters, including the hit rate
+        """
+        return {
+            'segment': cls.__segment_pool.get_stats(),
+            'buffer': cls.__buffer_pool.get_stats()
+        }
 
     @classmethod
     def open_network(cls, udp_port, proxy_addr):
@@ -156,35 +216,151 @@ class RxProtocol:
     @classmethod
     def __receive(cls):
         """ Blocking call to receive from the UDP socket and send it to the
-        socket.
+        socket. Every wakeup drains the datagrams that are ready, up to
+        MAX_BATCH, and queues each connection its segments in one batch
+        on the worker of the connection. A batch that finds the queue of
+        its worker full is dropped, like a full network queue would, and
+        the peer resends it. Segments of peers no connected socket owns
+        yet all go to the worker of the port, so a listening socket sees
+        the handshakes of its clients one at a time.
         Infinite server.
         :return: None
         """
-
         while True:
-            # Receive from UDP
             cls.__logger.info("RxP waits to RECEIVE")
-            received = cls.__udp_sock.recvfrom(cls.BUFF_SIZE)
-            cls.__receive_count += 1
-            cls.__logger.info("RxP RECEIVES")
-            # Objectize the segment (packet) and get the source IP:port
-            segment = Packeter.objectize(received[0])
-            my_port = segment.get_dst_port()
-            peer_addr = (received[1][0], segment.get_src_port())
-            cls.__logger.info("RxP receives something of length " + str(len(
-                received[0])) + " from " + str(peer_addr))
-
-            port = cls.__ports.get(peer_addr)
-            if port in cls.__sockets.keys():
-                dest_socket = cls.__sockets.get(port)
-            else:
-                dest_socket = cls.__sockets.get(my_port)
-            if dest_socket:
-                dest_socket._process_rcvd(peer_addr[0], segment)
-            cls.__logger.info("RxP RECEIVED:\nsrc: %s\ndata: %s" % (
-                str(peer_addr), str(segment)))
+            received = 0
+            # (peer address, my port) -> [[segment], [datagram buffer],
+            # bytes held], in arrival order
+            batches = {}
+            flags = 0
+            while received < cls.MAX_BATCH:
+                buff = cls.__buffer_pool.acquire()
+                try:
+                    nbytes, src = cls.__udp_sock.recvfrom_into(buff, 0, flags)
+                except BlockingIOError:
+                    cls.__buffer_pool.release(buff)
+                    break
+                received += 1
+                datagram = memoryview(buff)[:nbytes]
+                if nbytes <= cls.COPY_SIZE:
+                    datagram = bytes(datagram)
+                    cls.__buffer_pool.release(buff)
+                    buff = None
+                if not cls.__decode(datagram, buff, src, batches) and \
+                        buff is not None:
+                    cls.__buffer_pool.release(buff)
+                if not cls.__dont_wait:
+                    break
+                flags = cls.__dont_wait
+            cls.__receive_count += received
+            cls.__logger.info("RxP RECEIVES %d datagrams", received)
+            for key, (segments, buffers, size) in batches.items():
+                task = functools.partial(cls.__deliver, key, segments,
+                                         buffers)
+                if not cls.__dispatcher.submit(cls.__shard(key), task,
+                                               size=size):
+                    cls.__logger.info("DROPPED %d segments for %s, the "
+                                      "worker is behind", len(segments), key)
+                    cls.__release(segments, buffers)
             cls.print_stats()
 
+    @classmethod
+    def __decode(cls, datagram, buff, src, batches):
+        """ Adds the segments of a datagram to the batch of the connection
+        it belongs to, the batch keeps the buffer until they are processed
+        and counts the bytes it holds on to
+        :param datagram: the datagram
+        :param buff: the pooled buffer the datagram lives in, None if it
+        was copied out
+        :param src: the address the datagram came from
+        :param batches: dict of (peer address, my port) to its segments,
+        buffers and the bytes they hold
+        :return: False if no socket owns the datagram
+        """
+        # Get the source IP:port, the rest of the segment is only
+        # objectized if some socket owns it
+        ports = Packeter.peek_ports(datagram)
+        if ports is None:
+            return False
+        src_port, my_port = ports
+        peer_addr = (src[0], src_port)
+        if cls.__ports.get(peer_addr) not in cls.__sockets and \
+                my_port not in cls.__sockets:
+            return False
+        batch = batches.setdefault((peer_addr, my_port), [[], [], 0])
+        segments, buffers = batch[0], batch[1]
+        if buff is not None:
+            buffers.append(buff)
+            batch[2] += len(buff)
+        else:
+            batch[2] += len(datagram)
+        # a datagram may carry several segments of one connection
+        for binary in Packeter.split(datagram):
+            segment = Packeter.objectize(binary, pool=cls.__segment_pool)
+            if segment is not None:
+                segments.append(segment)
+                cls.__logger.debug("RxP RECEIVED:\nsrc: %s\ndata: %s",
+                                   peer_addr, segment)
+        return True
+
+    @classmethod
+    def __shard(cls, key):
+        """ The key of the worker a batch runs on
+        :param key: the peer address and my port of the batch
+        :return: the key itself if the peer is connected to one of our
+        sockets, else my port
+        """
+        peer_addr, my_port = key
+        dest_socket = cls.__sockets.get(my_port)
+        if dest_socket is not None and \
+                cls.__addr_port_pairs.get(dest_socket) == peer_addr or \
+                cls.__ports.get(peer_addr) in cls.__sockets:
+            return key
+        return my_port
+
+    @classmethod
+    def __deliver(cls, key, segments, buffers):
+        """ Hands the segments of a connection to the socket that owns it,
+        on the worker of the connection. Until the peer is registered to a
+        socket, the segments go to the socket of the port one by one, since
+        one of them (the end of a passive open) may register the peer to a
+        new socket
+        :param key: the peer address and my port
+        :param segments: the segments, in arrival order
+        :param buffers: the buffers of the datagrams they came in
+        :return: None
+        """
+        peer_addr, my_port = key
+        try:
+            i = 0
+            while i < len(segments):
+                port = cls.__ports.get(peer_addr)
+                dest_socket = cls.__sockets.get(my_port)
+                if dest_socket is not None and \
+                        cls.__addr_port_pairs.get(dest_socket) == peer_addr:
+                    # the peer may talk to several of our sockets, the
+                    # port tells which
+                    batch = segments[i:]
+                elif port in cls.__sockets:
+                    batch = segments[i:]
+                    dest_socket = cls.__sockets.get(port)
+                else:
+                    batch = segments[i:i + 1]
+                if dest_socket:
+                    dest_socket._process_rcvd_batch(
+                        [(peer_addr[0], segment) for segment in batch])
+                i += len(batch)
+        finally:
+            # the sockets copied what they keep out of the datagrams
+            cls.__release(segments, buffers)
+
+    @classmethod
+    def __release(cls, segments, buffers):
+        for segment in segments:
+            cls.__segment_pool.release(segment)
+        for buff in buffers:
+            cls.__buffer_pool.release(buff)
+
     @classmethod
     def send(cls, address, packet):
         """ Interface the socket and UDP, to send a packet through the UDP by
@@ -193,16 +369,49 @@ class RxProtocol:
         :param packet: the packet to be sent
         :return: None
         """
-        cls.__debug_state()
-        bin = Packeter.binarize(packet)
-        cls.__logger.info(
-            "RxProtocol TRIES to send something with length of " + str(
-                len(bin)) + '\n' + str(packet))
-        cls.__udp_sock.sendto(bin, cls.__proxy_addr)
-        cls.__send_count += 1
-        cls.__logger.info("RxProtocol SENT something to " + str(address))
+        cls.send_batch(address, [packet])
+
+    @classmethod
+    def send_batch(cls, address, packets, datagram_budget=0):
+        """ Sends packets of one connection, coalescing consecutive packets
+        into one datagram as long as it stays within datagram_budget bytes
+        :param address: the address to send the packets
+        :param packets: the packets to be sent, in order
+        :param datagram_budget: the maximum datagram size, 0 to send every
+        packet in its own datagram
+        :return: None
+        """
+        if cls.__logger.isEnabledFor(logging.DEBUG):
+            cls.__debug_state()
+        datagram_budget = min(datagram_budget, Packeter.MAX_DATAGRAM)
+        buffers = []
+        size = 0
+        for packet in packets:
+            header = Packeter.binarize_header(packet)
+            data = packet.get_data()
+            length = len(header) + len(data)
+            if buffers and size + length > datagram_budget:
+                cls.__send_datagram(address, buffers, size)
+                buffers = []
+                size = 0
+            buffers.append(header)
+            buffers.append(data)
+            size += length
+            cls.__logger.debug("RxProtocol TRIES to send\n%s", packet)
+        if buffers:
+            cls.__send_datagram(address, buffers, size)
         cls.print_stats()
 
+    @classmethod
+    def __send_datagram(cls, address, buffers, size):
+        if cls.__has_sendmsg:
+            # gather headers and data in the kernel instead of joining them
+            cls.__udp_sock.sendmsg(buffers, [], 0, cls.__proxy_addr)
+        else:
+            cls.__udp_sock.sendto(b''.join(buffers), cls.__proxy_addr)
+        cls.__send_count += 1
+        cls.__logger.info("RxProtocol SENT %d bytes to %s", size, address)
+
     @classmethod
     def ar_send(cls, dest_addr, msg, stop_func=lambda: False):
         # TODO: Van ini apaan
@@ -235,5 +444,10 @@ class RxProtocol:
 
     @classmethod
     def print_stats(cls):
-        cls.__logger.debug("UDP receive count: " + str(cls.__receive_count))
-        cls.__logger.debug("UDP send count: " + str(cls.__send_count))
+        if not cls.__logger.isEnabledFor(logging.DEBUG):
+            return
+        cls.__logger.debug("UDP receive count: %d", cls.__receive_count)
+        cls.__logger.debug("UDP send count: %d", cls.__send_count)
+        cls.__logger.debug("Pools: %s", cls.get_pool_stats())
+        cls.__logger.debug("Timers pending: %d", cls.__timers.get_pending())
+        cls.__logger.debug("Workers: %s", cls.__dispatcher.get_stats())
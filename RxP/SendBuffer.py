@@ -1,6 +1,7 @@
-import collections
+import bisect
 import threading
 import random
+import time
 
 from FxA.util import Util
 from RxP.Packeter import Packeter
@@ -10,134 +11,530 @@ from RxP import rxpsocket
 class SendBuffer:
     __logger = Util.setup_logger()
 
+    # acked slots at the front of the ring are dropped in one go once
+    # there are this many of them
+    COMPACT_THRESHOLD = 1024
+
+    # default capacity in maximum sized segments, and the share of the
+    # capacity a full buffer has to drain to before writers wake up
+    BUFFER_SEGMENTS = 1024
+    LOW_WATERMARK_RATIO = 0.5
+
     def __init__(self, src_port, dst_port):
         """ Created a new send buffer
         :return: None
         """
-        self.__send_buffer = collections.deque(maxlen=1)
-        self.__last_ackd = 0
+        # The ring holds the segments in sequence order. Positions in the
+        # stream are byte offsets from the first sequence number, so they
+        # grow without wrapping; sequence numbers are only derived from
+        # them at the edges.
+        #   __ends[i] : offset right after segment i
+        #   __head    : index of the oldest segment not cumulatively acked
+        #   __next    : index of the next segment to send, everything
+        #               between __head and __next is in flight
+        #   __high    : index of the first segment never sent, a timeout
+        #               pulls __next back to __head but leaves __high
+        #   __una     : offset of the oldest unacked byte
+        #   __queued  : offset the next put segment starts at
+        # __sent_at[i] is when segment i was first sent, None until then,
+        # and __retransmits[i] how many times it was sent again since
+        self.__segments = []
+        self.__ends = []
+        self.__sacked = []
+        self.__sent_at = []
+        self.__retransmits = []
+        self.__head = 0
+        self.__next = 0
+        self.__high = 0
+        self.__una = 0
+        self.__queued = 0
+        self.__first_seq_num = 0
+        # fast recovery lasts until the offset sent before the loss is
+        # acked, and only data sent after it may start another one
+        self.__in_recovery = False
+        self.__recover = 0
+        # during fast recovery, segments before __rexmit were resent or
+        # selectively acked, and the ones not selectively acked before
+        # __sack_high (one past the highest segment the peer selectively
+        # acked) are lost
+        self.__rexmit = 0
+        self.__sack_high = 0
+        # data is accepted up to the high watermark, in bytes, nothing
+        # before commit
+        self.__high_watermark = 0
+        self.__low_watermark = 0
         self.__logger.info("Send Buffer created")
-        self.__next_seq_num = 0
         self.__src_port = src_port
         self.__dst_port = dst_port
         self.__class_lock = threading.Lock()
         self.__full_cond = threading.Condition(self.__class_lock)
-        self.__resize_cond = threading.Condition(self.__class_lock)
+        self.__compressor = None
+        self.__mss = Packeter.MSS
+        self.__rto_estimator = None
+        self.__congestion_control = None
+
+    def set_mss(self, mss):
+        self.__mss = mss
+
+    def set_compressor(self, compressor):
+        self.__compressor = compressor
+
+    def set_rto_estimator(self, rto_estimator):
+        self.__rto_estimator = rto_estimator
+
+    def set_congestion_control(self, congestion_control):
+        self.__congestion_control = congestion_control
+
+    def get_in_flight(self):
+        """ Number of bytes sent but not acked yet
+        :return: the number of bytes
+        """
+        return self.__sent_end() - self.__una
+
+    def has_unsent(self):
+        return self.__next < len(self.__segments)
 
+    def get_unacked_seq_num(self):
+        return self.__seq_num(self.__una)
+
+    def is_in_recovery(self):
+        return self.__in_recovery
 
     def get_next_seq_num(self):
-        return self.__next_seq_num
+        return self.__seq_num(self.__queued)
 
-    def commit(self, buffer_size=1024):
-        self.__resize_cond.acquire()
-        self.__send_buffer = collections.deque(
-            maxlen=buffer_size,
-            iterable=self.__send_buffer
-        )
-        self.__resize_cond.release()
+    def commit(self, buffer_size=None):
+        """ Sizes the buffer once the connection is established
+        :param buffer_size: the capacity in bytes, None for BUFFER_SEGMENTS
+        maximum sized segments
+        :return: None
+        """
+        self.__full_cond.acquire()
+        if buffer_size is None:
+            buffer_size = self.BUFFER_SEGMENTS * self.__mss
+        self.__high_watermark = max(buffer_size, 1)
+        self.__low_watermark = int(buffer_size * self.LOW_WATERMARK_RATIO)
+        self.__full_cond.notify_all()
+        self.__full_cond.release()
+
+    def get_buffered(self):
+        """ Number of bytes put but not acked yet
+        :return: the number of bytes
+        """
+        return self.__queued - self.__una
 
     def generate_seq_num(self):
-        self.__next_seq_num = random.randint(0, rxpsocket.MAX_SEQ_NUM - 1) + 1
+        """ Picks a random initial sequence number. Whatever was buffered
+        under the old numbering (the first YO! of an active open) is
+        superseded and dropped
+        :return: None
+        """
+        self.__full_cond.acquire()
+        self.__segments = []
+        self.__ends = []
+        self.__sacked = []
+        self.__sent_at = []
+        self.__retransmits = []
+        self.__head = self.__next = self.__high = 0
+        self.__rexmit = self.__sack_high = 0
+        self.__una = self.__queued = self.__recover = 0
+        self.__in_recovery = False
+        self.__first_seq_num = random.randint(0, rxpsocket.MAX_SEQ_NUM - 1)
+        self.__full_cond.release()
 
     def notify_ack(self, new_acknum):
         """ Remove any segment sent successfully from buffer. now the
-        ACK_NUM is what the peer expect next, not what
-        they received last think if the last_acknum overflow, such that
-        self.__last_ackd = 65535 and last_acknum is 5
+        ACK_NUM is what the peer expect next, not what they received last.
+        ACK_NUM is compared to the oldest unacked byte in serial number
+        arithmetic, so it only counts when it falls in what was sent
         :param new_acknum: the newest acknowledgement number
+        :return: the number of bytes newly acked
+        """
+        self.__full_cond.acquire()
+        acked = self.__distance(new_acknum)
+        if 0 < acked <= self.__high_end() - self.__una:
+            self.__una += acked
+            # every segment ending at or before the ACK is retired
+            retired = bisect.bisect_right(
+                self.__ends, self.__una, self.__head, self.__high)
+            if retired > self.__head:
+                self.__sample_rtt(retired - 1)
+            self.__notify_congestion_control(acked)
+            # a flush on another thread may still be sending a retired
+            # segment, so segments are not pooled but left to the garbage
+            # collector
+            for i in range(self.__head, retired):
+                self.__segments[i] = None
+            self.__head = retired
+            self.__next = max(self.__next, retired)
+            self.__rexmit = max(self.__rexmit, retired)
+            self.__sack_high = max(self.__sack_high, retired)
+            self.__compact()
+        else:
+            acked = 0
+        if self.__queued - self.__una <= self.__low_watermark:
+            self.__full_cond.notify_all()
+        self.__full_cond.release()
+        self.__logger.info("NOTIFY new ack: %d", new_acknum)
+        return acked
+
+    def __notify_congestion_control(self, acked):
+        congestion_control = self.__congestion_control
+        if self.__in_recovery and self.__una >= self.__recover:
+            self.__in_recovery = False
+            if congestion_control is not None:
+                congestion_control.on_recovery_exit()
+        elif congestion_control is None:
+            return
+        elif self.__in_recovery:
+            congestion_control.on_partial_ack(acked)
+        else:
+            congestion_control.on_ack(acked)
+
+    def enter_recovery(self):
+        """ Starts fast recovery on the third duplicate ACK, unless the
+        loss happened to data sent before the previous recovery or timeout
+        :return: True if the oldest unacked segment has to be retransmitted
+        """
+        self.__full_cond.acquire()
+        entered = not self.__in_recovery and self.__una > self.__recover \
+            and self.__next > self.__head
+        if entered:
+            self.__in_recovery = True
+            self.__recover = self.__high_end()
+            self.__rexmit = self.__head
+            if self.__congestion_control is not None:
+                self.__congestion_control.on_loss(self.get_in_flight())
+        self.__full_cond.release()
+        return entered
+
+    def notify_dup_ack(self):
+        """ Another duplicate ACK arrived after the third one
+        :return: None
+        """
+        if self.__in_recovery and self.__congestion_control is not None:
+            self.__congestion_control.on_dup_ack()
+
+    def __sample_rtt(self, i):
+        """ Samples the RTT from segment i once it is acked. Following
+        Karn's rule, a segment sent more than once is not sampled
+        :param i: the index of the segment
+        :return: None
+        """
+        estimator = self.__rto_estimator
+        if estimator is not None:
+            sent_at = self.__sent_at[i]
+            if sent_at is not None and not self.__retransmits[i]:
+                sample_rtt = time.monotonic() - sent_at
+                estimator.update_rto_interval(sample_rtt)
+                if self.__congestion_control is not None:
+                    self.__congestion_control.on_rtt_sample(sample_rtt)
+            estimator.reset_backoff()
+
+    def notify_sack(self, sack_blocks):
+        """ Marks the buffered segments that the peer received out of
+        order, so they are not retransmitted
+        :param sack_blocks: list of (start, end) sequence number ranges
         :return: None
         """
+        modulo = rxpsocket.MAX_SEQ_NUM
         self.__full_cond.acquire()
-        is_overflow = self.__last_ackd - new_acknum > 2147483647
-        normal = new_acknum > self.__last_ackd
-        if normal or is_overflow:
-            self.__last_ackd = new_acknum
-            buffer = self.__send_buffer
-            while len(buffer) > 0 and ((buffer[0].get_seq_num() <
-                new_acknum) or (is_overflow and
-                buffer[0].get_seq_num() > new_acknum)):
-                # TODO: kayaknya bener sih
-                buffer.popleft()
-                print('popping')
-        self.__full_cond.notify()
+        sent_end = self.__high_end()
+        for left, right in sack_blocks:
+            start = self.__una + self.__distance(left)
+            end = start + (right - left) % modulo
+            if end > sent_end:
+                # not something we sent, the distance must have wrapped
+                continue
+            first = bisect.bisect_right(
+                self.__ends, start, self.__head, self.__high)
+            last = bisect.bisect_right(
+                self.__ends, end, self.__head, self.__high)
+            for i in range(first, last):
+                # only segments that lie wholly in the block
+                if self.__ends[i] - self.__length(i) >= start:
+                    self.__sacked[i] = True
+                    self.__sack_high = max(self.__sack_high, i + 1)
         self.__full_cond.release()
-        self.__logger.info("NOTIFY new ack: %d" % new_acknum)
+        self.__logger.info("NOTIFY sack: %s", sack_blocks)
 
-    def __put_control(self, yo=False, cya=False):
-        self.__send_buffer.append(Packeter.control_packet(
+    def __put_control(self, yo=False, cya=False, options=None):
+        self.__append(Packeter.control_packet(
             src_port=self.__src_port,
             dst_port=self.__dst_port,
-            seq_num=self.__next_seq_num,
+            seq_num=self.__seq_num(self.__queued),
             yo=yo,
-            cya=cya
-        ))
-        self.__increment_next_seq_num()
+            cya=cya,
+            options=options
+        ), self.__queued + 1)
 
     def __put_data(self, data):
-        for segment in Packeter.packetize(
-                src_port=self.__src_port,
-                dst_port=self.__dst_port,
-                seq_num=self.__next_seq_num,
-                data=data
-        ):
-            self.__send_buffer.append(segment)
-        if data:
-            for i in range(0, len(data)):
-                self.__increment_next_seq_num()
-
-    def put(self, yo=False, cya=False, data=None):
-        """ Puts the data in the send buffer.
-        Returns the next sequence number
-        :param data: the data being sent
-        :return: the sequence number + length of the data
-        """
-
-        maxlen = self.__send_buffer.maxlen
-        self.__logger.debug('send buffer size: ' + str(len(
-            self.__send_buffer)) + '/' + str(self.__send_buffer.maxlen))
-        # self.__full_cond.acquire()
-        # self.__full_cond.wait_for(
-        #     predicate=lambda: len(self.__send_buffer) < maxlen
-        # )
-        if maxlen and len(self.__send_buffer) == maxlen:
-            raise OverflowError
-        if yo and not cya or cya and not yo:
-            self.__put_control(yo=yo, cya=cya)
-        elif not yo and not cya:
-            self.__put_data(data=data)
-        # self.__full_cond.release()
-        self.__logger.info("PUT data in the send buffer")
-
-    def take(self, ack, ack_num, self_rcv_wind_size, max_segment=0):
+        data = self.__fill_tail(data)
+        if not data:
+            return
+        modulo = rxpsocket.MAX_SEQ_NUM
+        start_seq = self.__seq_num(self.__queued)
+        start = self.__queued
+        end = start + len(data)
+        segments = Packeter.packetize(
+            src_port=self.__src_port,
+            dst_port=self.__dst_port,
+            seq_num=start_seq,
+            data=data,
+            compressor=self.__compressor,
+            mss=self.__mss
+        )
+        # a segment spans up to the next one, its data may be compressed
+        for i in range(0, len(segments) - 1):
+            self.__append(segments[i], start + (segments[i + 1].get_seq_num()
+                                                - start_seq) % modulo)
+        self.__append(segments[-1], end)
+
+    def __fill_tail(self, data):
+        """ Tops the last segment up to the MSS if it was never sent, so
+        small writes end up in full segments
+        :param data: the data being put
+        :return: the part of the data that did not fit
+        """
+        last = len(self.__segments) - 1
+        if last < self.__high:
+            return data
+        tail = self.__segments[last]
+        if tail.is_yo() or tail.is_cya() or tail.is_compressed():
+            return data
+        tail_data = tail.get_data()
+        room = self.__mss - len(tail_data)
+        if room <= 0:
+            return data
+        topup = data[:room]
+        tail.set_data(bytes(tail_data) + bytes(topup))
+        Packeter.compute_checksum(tail)
+        self.__ends[last] += len(topup)
+        self.__queued = self.__ends[last]
+        return data[room:]
+
+    def __append(self, segment, end):
+        self.__segments.append(segment)
+        self.__ends.append(end)
+        self.__sacked.append(False)
+        self.__sent_at.append(None)
+        self.__retransmits.append(0)
+        self.__queued = end
+
+    def put(self, yo=False, cya=False, data=None, options=None, block=True):
+        """ Puts the data in the send buffer. YO! and CYA segments always
+        fit, data is accepted up to the high watermark. When the buffer is
+        full, a blocking put waits until it drained to the low watermark
+        :param data: the data being sent, a memoryview
+        :param options: the header options of a YO! or CYA segment
+        :param block: False to return at once when the buffer is full
+        :return: the number of bytes of data accepted
+        """
+        accepted = 0
+        self.__full_cond.acquire()
+        try:
+            self.__logger.debug('send buffer size: %d/%d',
+                                self.__queued - self.__una,
+                                self.__high_watermark)
+            if yo and not cya or cya and not yo:
+                self.__put_control(yo=yo, cya=cya, options=options)
+            elif not yo and not cya and data:
+                if block and self.__queued - self.__una >= \
+                        self.__high_watermark:
+                    self.__full_cond.wait_for(
+                        predicate=lambda: self.__queued - self.__una <=
+                        self.__low_watermark
+                    )
+                data = data[:max(self.__high_watermark -
+                                 (self.__queued - self.__una), 0)]
+                if not data.readonly:
+                    # segments refer to the data until they are acked, take
+                    # a snapshot so the caller is free to reuse the buffer
+                    data = memoryview(bytes(data))
+                self.__put_data(data=data)
+                accepted = len(data)
+        finally:
+            self.__full_cond.release()
+        self.__logger.info("PUT %d bytes in the send buffer", accepted)
+        return accepted
+
+    def take(self, ack, ack_num, self_rcv_wind_size, max_bytes=0,
+             sack_blocks=None, retransmit=False, force_ack=True,
+             pacer=None, nagle=False, corked=False):
         """ Put ack_num and ack_bit and checksum just before pushing
-        segments to lower layer
+        segments to lower layer. Only segments never sent before are taken,
+        for as long as the data in flight stays within max_bytes. During
+        fast recovery the holes the peer's selective ACKs reveal are resent
+        first, each once, and count against max_bytes as well. When
+        nothing is in flight one segment is always taken, so we learn once
+        a closed window opens
         :param ack_num: the acknowledgement number
-        :param max_segment: the maximum segment size
+        :param max_bytes: the number of bytes we may have in flight
+        :param sack_blocks: the ranges we received out of order
+        :param retransmit: True to treat everything in flight as lost and
+        start over from the oldest unacked segment, skipping the ones the
+        peer selectively acked. Only max_bytes of them are resent, the
+        rest follow as the window grows
+        :param force_ack: True to send a pure ACK if there is nothing to send
+        :param pacer: the TokenBucket the segments are paced with, segments
+        are taken while it has tokens and it is charged for their sequence
+        space, None for no limit
+        :param nagle: True to hold a last segment short of the MSS back
+        while data is in flight, it may still grow
+        :param corked: True to hold a last segment short of the MSS back
+        until uncorked
         :return: the segments
         """
-        buffer = self.__send_buffer
-        # self.__class_lock.acquire()
-        if len(buffer) == 0:
-            self.put()
-        max_segment = max(min(max_segment, len(buffer)), 1)
-        # if max_segment == len(buffer) and max_segment > 1:
-        #     max_segment -= 1
-        segments = []
-        self.__logger.debug("Max Segment: " + str(max_segment) + ' Bufferlen: '
-            '' + str(len(buffer)))
-        assert max_segment > 0
-        assert len(buffer) > 0
-        for i in range(0, max_segment):
-            if i < len(buffer):
-                prepare = buffer[i]
-                if ack:
-                    prepare.set_ack(ack_num=ack_num)
-                prepare.set_window_size(new_size=self_rcv_wind_size)
-                Packeter.compute_checksum(prepare)
-                segments.append(prepare)
-        # self.__class_lock.release()
-        self.__logger.info("TAKE from the send buffer")
+        self.__full_cond.acquire()
+        limit = self.__una + max_bytes
+        now = time.monotonic()
+        taken = []
+        if retransmit:
+            self.__next = self.__head
+            # a timeout ends fast recovery, losses of what was sent so far
+            # do not count again
+            self.__in_recovery = False
+            self.__recover = self.__high_end()
+        max_burst = None if pacer is None else pacer.get_tokens()
+        burst = 0
+        if self.__in_recovery:
+            burst, limit = self.__take_holes(taken, limit, max_burst)
+        i = self.__next
+        while i < len(self.__segments) and (
+                i == self.__head or self.__ends[i] <= limit) and (
+                max_burst is None or burst < max_burst):
+            if (corked or nagle and i > self.__head) and \
+                    self.__is_growing(i):
+                break
+            if not self.__sacked[i]:
+                self.__mark_sent(i, now)
+                taken.append(self.__segments[i])
+                burst += self.__length(i)
+            i += 1
+        self.__next = i
+        self.__high = max(self.__high, i)
+        if pacer is not None:
+            pacer.consume(burst)
+        if not taken and ack and force_ack:
+            # nothing to (re)send, the peer still needs an ACK
+            taken.append(Packeter.control_packet(
+                src_port=self.__src_port,
+                dst_port=self.__dst_port,
+                seq_num=self.__seq_num(self.__sent_end())
+            ))
+        segments = self.__stamp(taken, ack, ack_num, self_rcv_wind_size,
+                                sack_blocks)
+        self.__full_cond.release()
+        self.__logger.info("TAKE %d segments from the send buffer",
+                           len(segments))
         return segments
 
-    def __increment_next_seq_num(self):
-        self.__next_seq_num = (self.__next_seq_num + 1) % rxpsocket.MAX_SEQ_NUM
+    def __take_holes(self, taken, limit, max_burst):
+        """ Takes the lost segments below the highest selectively acked one
+        that were not resent during this recovery yet
+        :param taken: the list the segments are added to
+        :param limit: the offset the data in flight may reach
+        :param max_burst: the number of bytes a pacer lets out now
+        :return: the bytes taken, and the limit left for new data
+        """
+        burst = 0
+        sent_end = self.__sent_end()
+        i = max(self.__rexmit, self.__head)
+        while i < self.__sack_high and (
+                max_burst is None or burst < max_burst):
+            if not self.__sacked[i]:
+                length = self.__length(i)
+                if sent_end + length > limit:
+                    break
+                self.__mark_sent(i, None)
+                taken.append(self.__segments[i])
+                burst += length
+                limit -= length
+            i += 1
+        self.__rexmit = i
+        return burst, limit
+
+    def __mark_sent(self, i, now):
+        if self.__sent_at[i] is None:
+            self.__sent_at[i] = now
+        else:
+            self.__retransmits[i] += 1
+
+    def take_oldest(self, ack, ack_num, self_rcv_wind_size, sack_blocks=None):
+        """ Takes the oldest unacked segment again for a retransmission,
+        without moving the in flight boundary, unless it was already resent
+        during this fast recovery
+        :param ack_num: the acknowledgement number
+        :param sack_blocks: the ranges we received out of order
+        :return: the segments, empty if there is nothing to resend
+        """
+        self.__full_cond.acquire()
+        taken = []
+        head = self.__head
+        if self.__next > head and not (
+                self.__in_recovery and self.__rexmit > head):
+            taken.append(self.__segments[head])
+            self.__mark_sent(head, None)
+            if self.__in_recovery:
+                self.__rexmit = head + 1
+        segments = self.__stamp(taken, ack, ack_num, self_rcv_wind_size,
+                                sack_blocks)
+        self.__full_cond.release()
+        self.__logger.info("TAKE oldest from the send buffer")
+        return segments
+
+    def __stamp(self, taken, ack, ack_num, self_rcv_wind_size, sack_blocks):
+        return [Packeter.restamp(
+            packet=segment,
+            ack=ack,
+            ack_num=ack_num,
+            window_size=self_rcv_wind_size,
+            sack_blocks=sack_blocks
+        ) for segment in taken]
+
+    def __is_growing(self, i):
+        """ Whether segment i is the last one, never sent and short of the
+        MSS, so later data may still be put in it. Like __fill_tail(), a
+        compressed segment never grows
+        :param i: the index of the segment
+        :return: True if the segment may grow
+        """
+        segment = self.__segments[i]
+        return i == len(self.__segments) - 1 and i >= self.__high and \
+            not segment.is_yo() and not segment.is_cya() and \
+            not segment.is_compressed() and self.__length(i) < self.__mss
+
+    def __length(self, i):
+        return self.__ends[i] - (self.__ends[i - 1] if i else self.__una)
+
+    def __sent_end(self):
+        return self.__ends[self.__next - 1] if self.__next > self.__head \
+            else self.__una
+
+    def __high_end(self):
+        return self.__ends[self.__high - 1] if self.__high > self.__head \
+            else self.__una
+
+    def __seq_num(self, offset):
+        return (self.__first_seq_num + offset) % rxpsocket.MAX_SEQ_NUM
+
+    def __distance(self, seq_num):
+        """ Serial number distance from the oldest unacked byte
+        :param seq_num: a sequence number at or after it
+        :return: the distance in bytes
+        """
+        return (seq_num - self.__seq_num(self.__una)) % rxpsocket.MAX_SEQ_NUM
+
+    def __compact(self):
+        head = self.__head
+        if head >= self.COMPACT_THRESHOLD and 2 * head >= len(self.__segments):
+            del self.__segments[:head]
+            del self.__ends[:head]
+            del self.__sacked[:head]
+            del self.__sent_at[:head]
+            del self.__retransmits[:head]
+            self.__next -= head
+            self.__high -= head
+            self.__rexmit -= head
+            self.__sack_high -= head
+            self.__head = 0
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from FxA.util import Util
+
+
+class TimerHandle:
+    """ A timer armed on a TimerWheel, cancel() it like a threading.Timer
+    """
+    __slots__ = ('_tick', '_callback', '_slot', '_wheel')
+
+    def __init__(self, wheel, tick, callback):
+        self._wheel = wheel
+        self._tick = tick
+        self._callback = callback
+        self._slot = None
+
+    def cancel(self):
+        """ Stops the timer, nothing happens if it already fired
+        :return: None
+        """
+        self._wheel.cancel(self)
+
+
+class TimerWheel:
+    """ Hashed timer wheel driven by a single daemon thread.
+    A timer lands in the slot of the tick it expires on, so arming and
+    cancelling are O(1) whatever the number of timers. Timers longer than
+    one turn of the wheel stay in their slot until their tick comes round.
+    Callbacks run on the driver thread and must not block.
+    """
+    __logger = Util.setup_logger()
+
+    def __init__(self, resolution=0.01, size=512):
+        """ Creates a new timer wheel, the driver starts with the first timer
+        :param resolution: the length of a tick in seconds
+        :param size: the number of slots
+        :return: None
+        """
+        self.__resolution = resolution
+        self.__size = size
+        self.__slots = [{} for _ in range(size)]
+        # the last tick whose slot was expired
+        self.__tick = 0
+        self.__pending = 0
+        self.__start = time.monotonic()
+        self.__cond = threading.Condition(threading.Lock())
+        self.__driver = None
+
+    def schedule(self, delay, callback):
+        """ Arms a timer
+        :param delay: seconds until the callback is called, rounded up to
+        the next tick
+        :param callback: function with no param
+        :return: the TimerHandle to cancel it with
+        """
+        now = int((time.monotonic() - self.__start) / self.__resolution)
+        ticks = max(int(-(-delay // self.__resolution)), 1)
+        with self.__cond:
+            if not self.__pending:
+                # nothing armed, the slots up to now are all empty
+                self.__tick = max(self.__tick, now)
+                self.__cond.notify()
+            handle = TimerHandle(self, max(self.__tick, now) + ticks,
+                                 callback)
+            handle._slot = self.__slots[handle._tick % self.__size]
+            handle._slot[handle] = None
+            self.__pending += 1
+            if self.__driver is None:
+                self.__driver = threading.Thread(target=self.__drive,
+                                                 name='timer-wheel',
+                                                 daemon=True)
+                self.__driver.start()
+        return handle
+
+    def cancel(self, handle):
+        """ Disarms a timer, nothing happens if it already fired
+        :param handle: the TimerHandle schedule() returned
+        :return: None
+        """
+        with self.__cond:
+            if handle._slot is not None:
+                del handle._slot[handle]
+                handle._slot = None
+                self.__pending -= 1
+
+    def get_pending(self):
+        """ Number of timers armed
+        :return: the number of timers
+        """
+        return self.__pending
+
+    def __drive(self):
+        while True:
+            with self.__cond:
+                while not self.__pending:
+                    self.__cond.wait()
+                due = self.__tick + 1
+                wait = self.__start + due * self.__resolution - \
+                    time.monotonic()
+                if wait > 0:
+                    self.__cond.wait(wait)
+                    continue
+                self.__tick = due
+                slot = self.__slots[due % self.__size]
+                expired = [handle for handle in slot if handle._tick <= due]
+                for handle in expired:
+                    del slot[handle]
+                    handle._slot = None
+                self.__pending -= len(expired)
+            for handle in expired:
+                try:
+                    handle._callback()
+                except Exception:
+                    self.__logger.exception("Timer callback failed")
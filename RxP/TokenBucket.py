@@ -0,0 +1,59 @@
+import time
+
+
+class TokenBucket:
+    """ Token bucket that meters bytes sent at a given rate.
+    Tokens may go negative when a segment larger than the balance is sent,
+    the debt is paid back before anything else goes out.
+    """
+
+    def __init__(self, rate, burst):
+        """ Creates a new, full token bucket
+        :param rate: the bytes per second the bucket fills with
+        :param burst: the most tokens the bucket holds
+        :return: None
+        """
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = burst
+        self.__stamp = time.monotonic()
+
+    def set_rate(self, rate, burst):
+        """ Changes the rate, the tokens gained so far are kept
+        :param rate: the bytes per second the bucket fills with
+        :param burst: the most tokens the bucket holds
+        :return: None
+        """
+        self.__refill()
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = min(self.__tokens, burst)
+
+    def get_tokens(self):
+        """ The bytes that may be sent now
+        :return: the number of tokens, negative while in debt
+        """
+        self.__refill()
+        return self.__tokens
+
+    def consume(self, size):
+        """ Takes tokens for bytes that were sent
+        :param size: the number of bytes
+        :return: None
+        """
+        self.__refill()
+        self.__tokens -= size
+
+    def get_delay(self, size):
+        """ Time until size bytes may be sent
+        :param size: the number of bytes
+        :return: the delay in seconds, 0 if they may be sent now
+        """
+        self.__refill()
+        return max(size - self.__tokens, 0) / self.__rate
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__tokens + (now - self.__stamp) * self.__rate,
+                            self.__burst)
+        self.__stamp = now
@@ -1,11 +1,15 @@
+import functools
 import threading
 from queue import Queue
 from FxA.util import Util
+from RxP.Compressor import Compressor
+from RxP.NewReno import NewReno
 from RxP.Packeter import Packeter
 from RxP.RTOEstimator import RTOEstimator
 from RxP.RecvBuffer import RecvBuffer
 from RxP.RxProtocol import RxProtocol
 from RxP.SendBuffer import SendBuffer
+from RxP.TokenBucket import TokenBucket
 from exception import RxPException
 
 # list of all states
@@ -30,10 +34,17 @@ class States:
     CLOSE_WAIT = 'CLOSE_WAIT'
     LAST_WORD = 'LAST_WORD'
 
-MAX_SEQ_NUM = 4294967296
+MAX_SEQ_NUM = Packeter.MAX_SEQ_NUM
 
 class rxpsocket:
     MAX_INIT_RETRIES = int(5)
+    # duplicate ACKs that trigger a fast retransmit
+    DUP_ACK_THRESHOLD = int(3)
+    # a paced connection sends at most this much of its rate at once, in
+    # seconds, and the rate is cwnd/SRTT times the gain
+    PACING_INTERVAL = 0.01
+    SLOW_START_PACING_GAIN = 2.0
+    PACING_GAIN = 1.2
 
     __logger = Util.setup_logger()
 
@@ -59,8 +70,67 @@ class rxpsocket:
         self.__inbound_processor = lambda src_port, rcvd_segment: None
         self.__peer_window_size = 1
 
+        # maximum size of a datagram carrying several segments, 0 sends
+        # every segment in its own datagram
+        self.__coalesce_budget = 0
+
+        # whether we offer compression, and the compressor once both peers
+        # agreed on it
+        self.__compression = False
+        self.__compressor = None
+
+        # the MSS we ask for, and the MSS both peers agreed on
+        self.__requested_mss = Packeter.MSS
+        self.__mss = Packeter.MSS
+
+        # whether send() waits for room, and the size of the send buffer
+        self.__blocking = True
+        self.__send_buffer_size = None
+        self.__recv_buffer_size = None
+        # the cap of the receive window in segments instead, it follows the
+        # MSS both peers agree on
+        self.__recv_window_segments = None
+
+        # small writes are held back while data is in flight (Nagle), or
+        # until uncorked
+        self.__nagle = True
+        self.__corked = False
+
+        # how long an ACK for in order data may wait, 0 acks every
+        # segment, and the bytes received since our last ACK
+        self.__ack_delay = 0
+        self.__ack_pending = 0
+
+        # retransmission timeout of this connection
+        self.__rto_estimator = RTOEstimator()
+
+        # the congestion control class we use, and the instance of the
+        # connection
+        self.__congestion_algorithm = NewReno
+        self.__congestion_control = None
+        self.__dup_acks = 0
+
+        # whether segments are paced, a fixed rate in bytes per second or 0
+        # to follow cwnd/SRTT, and the token bucket of the connection
+        self.__pacing = False
+        self.__pacing_rate = 0
+        self.__pacer = None
+
+        # serializes flushes and the timers below, which run on the
+        # receiving worker, the timer driver and the application thread
+        self.__send_lock = threading.RLock()
+        # serializes processing received segments, a new connection gets
+        # segments on the worker of the listening socket and on its own
+        # while it is being set up
+        self.__recv_lock = threading.Lock()
+
         # replacement for static method var, please dont use it
         self.__flush_send_scheder = None
+        # changes whenever the retransmission timer is stopped, so a timer
+        # that fired meanwhile finds itself outdated
+        self.__rto_timer_id = 0
+        self.__delayed_ack_scheder = None
+        self.__pacing_scheder = None
         self.__schedule_active_closure_scheder = None
 
     def __str__(self):
@@ -68,6 +138,141 @@ class rxpsocket:
             (self.__state, self.__self_addr, self.__peer_addr,
              self.__inbound_processor.__name__))
 
+    def set_coalescing(self, datagram_budget):
+        """ Coalesce consecutive segments flushed together into datagrams of
+        at most datagram_budget bytes. Sockets accepted by a listening
+        socket inherit its setting
+        :param datagram_budget: the maximum datagram size in bytes, 0 to
+        disable coalescing
+        :return: None
+        """
+        self.__coalesce_budget = datagram_budget
+
+    def set_compression(self, enabled):
+        """ Offer to compress data during the next YO! exchange. Data is
+        only compressed if the peer offers it as well. Sockets accepted by a
+        listening socket inherit its setting
+        :param enabled: True to offer compression
+        :return: None
+        """
+        self.__compression = enabled
+
+    def set_mss(self, mss):
+        """ Ask for an MSS during the next YO! exchange, e.g. a large one on
+        loopback or LAN paths and a small one on constrained paths. The
+        connection uses the smaller of both peers' MSS. Sockets accepted by
+        a listening socket inherit its setting
+        :param mss: the MSS in bytes
+        :return: None
+        """
+        self.__requested_mss = max(min(int(mss), Packeter.MAX_MSS),
+                                   Packeter.MIN_MSS)
+
+    def set_blocking(self, flag):
+        """ In non-blocking mode send() queues what fits in the send buffer
+        and raises RxPException 109 if nothing does, instead of waiting
+        :param flag: False for non-blocking mode
+        :return: None
+        """
+        self.__blocking = flag
+
+    def set_nodelay(self, flag):
+        """ Send small writes at once instead of holding them back while
+        data is in flight to merge them into full segments (Nagle), for
+        latency sensitive sockets. Sockets accepted by a listening socket
+        inherit the setting
+        :param flag: True to disable Nagle
+        :return: None
+        """
+        self.__nagle = not flag
+
+    def cork(self):
+        """ Hold back segments short of the MSS until uncork(), so a
+        sequence of writes goes out in full segments
+        :return: None
+        """
+        self.__corked = True
+
+    def uncork(self):
+        """ Send what cork() held back
+        :return: None
+        """
+        self.__corked = False
+        if self.__send_buffer is not None:
+            self.__flush_send(force_ack=False)
+
+    def set_send_buffer_size(self, size):
+        """ Size the send buffer of the next connection, send() blocks once
+        this much data is unacked. Sockets accepted by a listening socket
+        inherit the setting
+        :param size: the size in bytes, None for 1024 segments
+        :return: None
+        """
+        self.__send_buffer_size = size
+
+    def set_recv_buffer_size(self, size):
+        """ Cap the receive window, which otherwise grows with what the
+        application reads per RTT up to 32768 segments. Applies to the
+        current connection as well. Sockets accepted by a listening socket
+        inherit the setting
+        :param size: the size in bytes, None for no cap but the default
+        :return: None
+        """
+        self.__recv_buffer_size = size
+        self.__recv_window_segments = None
+        if self.__recv_buffer is not None:
+            self.__recv_buffer.set_max_size(size)
+
+    def set_recv_window(self, segments):
+        """ Cap the receive window like set_recv_buffer_size(), in
+        segments of the MSS both peers agree on
+        :param segments: the number of segments
+        :return: None
+        """
+        self.__recv_window_segments = segments
+        if self.__recv_buffer is not None:
+            self.__recv_buffer.set_max_size(self.__get_recv_buffer_size())
+
+    def __get_recv_buffer_size(self):
+        """ The cap of the receive window in bytes, for the current MSS
+        :return: the number of bytes, None for the default
+        """
+        if self.__recv_window_segments is not None:
+            return self.__recv_window_segments * self.__mss
+        return self.__recv_buffer_size
+
+    def set_delayed_ack(self, delay):
+        """ Delay the ACK of in order data until two full segments arrived
+        or delay seconds passed, unless data going out carries it earlier.
+        Out of order data and control segments are always acked at once.
+        Sockets accepted by a listening socket inherit its setting
+        :param delay: the maximum delay in seconds, e.g. 0.04, 0 to ack
+        every segment
+        :return: None
+        """
+        self.__ack_delay = delay
+
+    def set_pacing(self, enabled, rate=0):
+        """ Spread the segments of a window over the RTT instead of
+        sending them back to back. Sockets accepted by a listening socket
+        inherit the setting
+        :param enabled: True to pace
+        :param rate: a fixed rate in bytes per second, 0 to pace at the
+        congestion window per smoothed RTT
+        :return: None
+        """
+        self.__pacing = enabled
+        self.__pacing_rate = rate
+
+    def set_congestion_control(self, algorithm):
+        """ Choose the congestion control of the next connection. Sockets
+        accepted by a listening socket inherit its setting
+        :param algorithm: a CongestionControl subclass, e.g. NewReno or
+        Cubic
+        :return: None
+        """
+        self.__congestion_algorithm = algorithm
+
     def bind(self, address):
         """ Bind the socket to address
         :param address: tuple of IP address and port to bind
@@ -121,6 +326,7 @@ class rxpsocket:
                 src_port=self.__self_addr[1],
                 dst_port=address[1]
             )
+            self.__send_buffer.set_rto_estimator(self.__rto_estimator)
 
             self.__recv_buffer = RecvBuffer()
 
@@ -151,8 +357,10 @@ class rxpsocket:
             self.__peer_addr = address
             self.__inbound_processor = self.__process_active_open
             self.__logger.info("Starting 4-way handshake procedure...")
+            self.__mss = self.__requested_mss
             self.__send_buffer.put(
-                yo=True
+                yo=True,
+                options=self.__yo_options(compression=self.__compression)
             )
             self.__flush_send(with_ack=False)
             cond.acquire()
@@ -204,17 +412,49 @@ class rxpsocket:
         return childsock, childsock.__peer_addr
 
     def send(self, data_bytes):
-        self.__send_buffer.put(
-            data=data_bytes
+        """ Queue as much of the data as the send buffer takes. A blocking
+        socket waits for room when the buffer is full
+        :param data_bytes: a bytes-like object
+        :return: the number of bytes queued, maybe less than all of them
+        """
+        data = memoryview(data_bytes).cast('B')
+        accepted = self.__send_buffer.put(
+            data=data,
+            block=self.__blocking
         )
-        # TODO: return number of bytes sent
-        self.__flush_send()
-        return len(data_bytes)
+        self.__flush_send(force_ack=False)
+        if len(data) and not accepted:
+            raise RxPException(109)
+        return accepted
+
+    def sendall(self, data_bytes):
+        """ Queue all of the data, waiting for room as often as needed
+        :param data_bytes: a bytes-like object
+        :return: None
+        """
+        data = memoryview(data_bytes).cast('B')
+        sent = 0
+        while sent < len(data):
+            sent += self.send(data[sent:])
 
     def recv(self, buffsize):
         return self.__recv_buffer.take(max_read=buffsize)
 
+    def recv_into(self, buffer, nbytes=0):
+        """ Receives data into a caller provided buffer instead of
+        returning a new bytes object. Blocks while there is no data
+        :param buffer: a writable bytes-like object
+        :param nbytes: the maximum number of bytes to receive, 0 for the
+        size of the buffer
+        :return: the number of bytes received
+        """
+        target = memoryview(buffer).cast('B')
+        if nbytes:
+            target = target[:nbytes]
+        return self.__recv_buffer.take_into(target)
+
     def close(self):
+        self.__corked = False
         self.__send_buffer.put(
             cya=True
         )
@@ -248,60 +488,351 @@ class rxpsocket:
     # and then pass the segment to buffer to process data related
     # information
     def _process_rcvd(self, src_ip, rcvd_segment):
-        self.__logger.info("Received segment...")
-        if Packeter.validate_checksum(rcvd_segment):
-            self.__inbound_processor(src_ip, rcvd_segment)
-        if rcvd_segment.is_yo() or rcvd_segment.is_cya() or \
-                rcvd_segment.get_data():
-            self.__flush_send(with_ack=self.__state != States.YO_RCVD)
-        self.__logger.debug(str(self))
+        self._process_rcvd_batch([(src_ip, rcvd_segment)])
+
+    def _process_rcvd_batch(self, segments):
+        """ Processes the segments that arrived for this socket together.
+        Segments with data or YO!/CYA are answered one by one, so the peer
+        still sees every duplicate ACK, but the ACKs that only make room
+        for new data are answered by one flush after the last of them
+        :param segments: list of (source IP, segment), in arrival order
+        :return: None
+        """
+        self.__logger.info("Received %d segments...", len(segments))
+        with self.__recv_lock:
+            clocked = False
+            for src_ip, rcvd_segment in segments:
+                clocked = self.__process_segment(src_ip, rcvd_segment) or \
+                    clocked
+            if clocked and self.__send_buffer is not None:
+                # the ACKs may have made room for new data
+                self.__flush_send(with_ack=self.__state != States.YO_RCVD,
+                                  force_ack=False)
+        self.__logger.debug('%s', self)
         cond = self.__state_cond
         cond.acquire()
         cond.notify()
         cond.release()
 
+    def __process_segment(self, src_ip, rcvd_segment):
+        """ Processes one received segment and answers it if it has to
+        :param src_ip: the source IP address of the segment
+        :param rcvd_segment: the received segment
+        :return: True if the segment only asks for an ACK clocked flush
+        """
+        delayable = False
+        if self.__is_wanted(src_ip, rcvd_segment) and \
+                Packeter.validate_checksum(rcvd_segment) and \
+                self.__inflate(rcvd_segment):
+            delayable = self.__is_ack_delayable(rcvd_segment)
+            self.__inbound_processor(src_ip, rcvd_segment)
+        if delayable:
+            self.__delay_ack(len(rcvd_segment.get_data()))
+        elif rcvd_segment.is_yo() or rcvd_segment.is_cya() or \
+                rcvd_segment.get_data():
+            self.__flush_send(with_ack=self.__state != States.YO_RCVD)
+        else:
+            return True
+        return False
+
+    def __is_ack_delayable(self, _rcvd_segment):
+        """ Only in order data that fills no gap may wait for its ACK
+        :param _rcvd_segment: the received segment, not processed yet
+        :return: True if the ACK may be delayed
+        """
+        return self.__ack_delay > 0 and \
+            self.__state == States.ESTABLISHED and \
+            bool(_rcvd_segment.get_data()) and \
+            not _rcvd_segment.is_yo() and not _rcvd_segment.is_cya() and \
+            self.__recv_buffer.is_expecting(_rcvd_segment) and \
+            not self.__recv_buffer.has_out_of_order()
+
+    def __delay_ack(self, size):
+        with self.__send_lock:
+            self.__ack_pending += size
+            if self.__ack_pending >= 2 * self.__mss:
+                self.__flush_send()
+            else:
+                # data going out now still carries the ACK
+                self.__flush_send(force_ack=False)
+                if self.__ack_pending and self.__delayed_ack_scheder is None:
+                    self.__delayed_ack_scheder = RxProtocol.schedule(
+                        self.__ack_delay, self.__send_delayed_ack)
+
+    def __send_delayed_ack(self):
+        with self.__send_lock:
+            self.__delayed_ack_scheder = None
+            if self.__ack_pending:
+                self.__flush_send()
+
+    def __inflate(self, _rcvd_segment):
+        """ Decompresses the data of a compressed segment in place, before
+        it reaches the receive buffer
+        :param _rcvd_segment: the received segment
+        :return: False if the segment has to be dropped
+        """
+        if not _rcvd_segment.is_compressed():
+            return True
+        if self.__compressor is None:
+            self.__logger.info("DROPPED compressed segment, compression was "
+                               "not negotiated")
+            return False
+        data = Compressor.inflate(_rcvd_segment.get_data(), self.__mss)
+        if data is None:
+            self.__logger.info("DROPPED segment with invalid compressed data")
+            return False
+        _rcvd_segment.set_data(data)
+        _rcvd_segment.set_compressed(False)
+        return True
+
+    def __negotiate(self, _rcvd_segment):
+        """ Agree on the connection options with the options of the peer's
+        YO!
+        :param _rcvd_segment: the YO! segment of the peer
+        :return: None
+        """
+        # a listening socket negotiates for every client from scratch
+        options = _rcvd_segment.get_options()
+        self.__mss = max(min(self.__requested_mss, options.get(
+            Packeter.OPT_MSS, Packeter.MSS)), Packeter.MIN_MSS)
+        self.__send_buffer.set_mss(self.__mss)
+        self.__recv_buffer.set_mss(self.__mss)
+        self.__logger.info("NEGOTIATED MSS: %d" % self.__mss)
+
+        self.__congestion_control = self.__congestion_algorithm(self.__mss)
+        self.__send_buffer.set_congestion_control(self.__congestion_control)
+
+        self.__compressor = None
+        method = options.get(Packeter.OPT_COMPRESS)
+        if self.__compression and method == Compressor.ZLIB:
+            self.__compressor = Compressor(method)
+            self.__send_buffer.set_compressor(self.__compressor)
+            self.__logger.info("NEGOTIATED compression")
+
+    def __yo_options(self, compression):
+        """ The options of our YO!, the active side offers what it asks
+        for, the passive side answers with what was agreed on
+        :param compression: True to include compression
+        :return: dict of option kind to value
+        """
+        options = {Packeter.OPT_MSS: self.__mss}
+        if compression:
+            options[Packeter.OPT_COMPRESS] = Compressor.ZLIB
+        return options
+
+    def __is_wanted(self, _src_ip, _rcvd_segment):
+        """ Header only check to drop misdirected, duplicate, or out of
+        window segments before their data is checksummed
+        :param _src_ip: the source IP address of the segment
+        :param _rcvd_segment: the received segment
+        :return: False if the segment would be discarded anyway
+        """
+        if self.__state in (States.OPEN, States.LISTEN, States.YO_SENT,
+                            States.YO_RCVD, States.SYN_YO_ACK_SENT,
+                            States.CLOSED):
+            # the handshake processors take care of themselves
+            return True
+        src_addr = (_src_ip, _rcvd_segment.get_src_port())
+        return src_addr == self.__peer_addr and \
+            self.__recv_buffer.is_in_window(_rcvd_segment)
+
     def __process_data_xchange(self, _src_ip, _rcvd_segment):
         src_addr = (_src_ip, _rcvd_segment.get_src_port())
-        if src_addr == self.__peer_addr and self.__recv_buffer.is_expecting(
+        if src_addr == self.__peer_addr and self.__recv_buffer.is_in_window(
                 _rcvd_segment):
+            in_order = self.__recv_buffer.is_expecting(_rcvd_segment)
 
             # allows send buffer to discard acked segments
-            self.__send_buffer.notify_ack(_rcvd_segment.get_ack_num())
+            acked = self.__send_buffer.notify_ack(_rcvd_segment.get_ack_num())
+            self.__notify_sack(_rcvd_segment)
+            if acked:
+                self.__dup_acks = 0
+                # new data was acked, the oldest segment in flight gets a
+                # full RTO from now
+                self.__arm_rto(restart=True)
+                if self.__send_buffer.is_in_recovery():
+                    # partial ACK, the next hole is lost as well
+                    self.__retransmit_oldest()
+            elif self.__is_dup_ack(_rcvd_segment):
+                self.__dup_acks += 1
+                if self.__dup_acks == self.DUP_ACK_THRESHOLD:
+                    if self.__send_buffer.enter_recovery():
+                        self.__retransmit_oldest()
+                elif self.__dup_acks > self.DUP_ACK_THRESHOLD:
+                    self.__send_buffer.notify_dup_ack()
 
             # keeptrack of peer window size
             self.__peer_window_size = _rcvd_segment.get_window_size()
 
             # let recv buffer to update the expected seq_num
             # if not control packet >> put data in recv_buffer
+            # out of order data is held until the gap is filled
             self.__recv_buffer.put(inbound_segment=_rcvd_segment)
 
             # if the peer initiate closing
-            if _rcvd_segment.is_cya():
+            if _rcvd_segment.is_cya() and in_order:
                 self.__state = States.CLOSE_WAIT
 
-    def __flush_send(self, with_ack=True):
-        if self.__flush_send_scheder is not None:
-            self.__flush_send_scheder.cancel()
-        flow_window = self.__peer_window_size
-        congestion_window = 2000000000 # TODO: WE still dont have congestion
-        # window
-        flushed = self.__send_buffer.take(
-            ack=with_ack,
-            ack_num=self.__recv_buffer.get_expected_seq_num(),
-            self_rcv_wind_size=self.__recv_buffer.get_window_size(),
-            # we still want to send 1 segment at a time even when peer
-            # closed their window so we know once it open
-            max_segment=max(min(flow_window, congestion_window), 1)
-        )
-        for segment in flushed:
-            RxProtocol.send(
+    def __is_dup_ack(self, _rcvd_segment):
+        """ A pure ACK that acks nothing new while data is in flight
+        :param _rcvd_segment: the received segment
+        :return: True if the segment is a duplicate ACK
+        """
+        return _rcvd_segment.is_ack() and not _rcvd_segment.get_data() and \
+            not _rcvd_segment.is_yo() and not _rcvd_segment.is_cya() and \
+            _rcvd_segment.get_ack_num() == \
+            self.__send_buffer.get_unacked_seq_num() and \
+            self.__send_buffer.get_in_flight() > 0
+
+    def __retransmit_oldest(self):
+        with self.__send_lock:
+            RxProtocol.send_batch(
                 address=self.__peer_addr,
-                packet=segment
+                packets=self.__send_buffer.take_oldest(
+                    ack=True,
+                    ack_num=self.__recv_buffer.get_expected_seq_num(),
+                    self_rcv_wind_size=self.__recv_buffer.get_window_size(),
+                    sack_blocks=self.__recv_buffer.get_sack_blocks()
+                ),
+                datagram_budget=self.__coalesce_budget
+            )
+
+    def __notify_sack(self, _rcvd_segment):
+        sack_blocks = _rcvd_segment.get_options().get(Packeter.OPT_SACK)
+        if sack_blocks:
+            self.__send_buffer.notify_sack(sack_blocks)
+
+    def __flush_send(self, with_ack=True, force_ack=True, retransmit=False):
+        """ Sends what the flow and congestion windows allow and arms the
+        retransmission timer if data is in flight and it does not run yet
+        :param with_ack: True to acknowledge what we received
+        :param force_ack: True to send a pure ACK if there is no data to
+        carry it
+        :param retransmit: True to resend from the oldest unacked segment
+        :return: None
+        """
+        with self.__send_lock:
+            send_buffer = self.__send_buffer
+            if send_buffer is None:
+                self.__arm_rto()
+                return
+            flow_window = self.__peer_window_size
+            congestion_window = flow_window
+            if self.__congestion_control is not None:
+                congestion_window = \
+                    self.__congestion_control.get_congestion_window()
+                if self.__dup_acks < self.DUP_ACK_THRESHOLD:
+                    # limited transmit (RFC 3042), the first duplicate ACKs
+                    # each let a new segment out
+                    congestion_window += self.__dup_acks * self.__mss
+            pacer = self.__get_pacer() if self.__pacing else None
+            flushed = send_buffer.take(
+                ack=with_ack,
+                ack_num=self.__recv_buffer.get_expected_seq_num(),
+                self_rcv_wind_size=self.__recv_buffer.get_window_size(),
+                # the send buffer still sends 1 segment when peer closed
+                # their window so we know once it open
+                max_bytes=min(flow_window, congestion_window),
+                sack_blocks=self.__recv_buffer.get_sack_blocks(),
+                retransmit=retransmit,
+                force_ack=force_ack,
+                pacer=pacer,
+                nagle=self.__nagle,
+                corked=self.__corked
             )
-        self.__flush_send_scheder = threading.Timer(
-            RTOEstimator.get_rto_interval(), self.__flush_send)
-        self.__flush_send_scheder.start()
-        self.__logger.debug(str(self))
+            RxProtocol.send_batch(
+                address=self.__peer_addr,
+                packets=flushed,
+                datagram_budget=self.__coalesce_budget
+            )
+            if pacer is not None:
+                self.__pace()
+            if flushed and with_ack:
+                # whatever we received is acked now
+                self.__ack_pending = 0
+                if self.__delayed_ack_scheder is not None:
+                    self.__delayed_ack_scheder.cancel()
+                    self.__delayed_ack_scheder = None
+            self.__arm_rto()
+            self.__logger.debug('%s', self)
+
+    def __arm_rto(self, restart=False):
+        """ Runs the retransmission timer like RFC 6298 does: it is armed
+        when data is in flight and no timer runs, restarted when an ACK
+        acks new data, and stopped once nothing is in flight. Writes and
+        duplicate ACKs leave a running timer alone
+        :param restart: True to restart a running timer
+        :return: None
+        """
+        with self.__send_lock:
+            send_buffer = self.__send_buffer
+            in_flight = send_buffer is not None and \
+                send_buffer.get_in_flight() > 0
+            if self.__flush_send_scheder is not None:
+                if in_flight and not restart:
+                    return
+                self.__flush_send_scheder.cancel()
+                self.__flush_send_scheder = None
+                # a timer that already fired and waits for the lock is
+                # outdated
+                self.__rto_timer_id += 1
+            if in_flight:
+                self.__flush_send_scheder = RxProtocol.schedule(
+                    self.__rto_estimator.get_rto_interval(),
+                    functools.partial(self.__retransmit, self.__rto_timer_id))
+
+    def __get_pacer(self):
+        """ Updates the pacing rate
+        :return: the TokenBucket of the connection, None while there is no
+        rate yet
+        """
+        rate = self.__pacing_rate
+        if not rate:
+            estimated_rtt = self.__rto_estimator.get_estimated_rtt()
+            congestion_control = self.__congestion_control
+            if not estimated_rtt or congestion_control is None:
+                return None
+            gain = self.SLOW_START_PACING_GAIN \
+                if congestion_control.is_slow_start() else self.PACING_GAIN
+            rate = gain * congestion_control.get_congestion_window() / \
+                estimated_rtt
+        burst = max(rate * self.PACING_INTERVAL, 2 * self.__mss)
+        if self.__pacer is None:
+            self.__pacer = TokenBucket(rate, burst)
+        else:
+            self.__pacer.set_rate(rate, burst)
+        return self.__pacer
+
+    def __pace(self):
+        """ Comes back for the rest of the data once the pacer, charged by
+        the send buffer for what was sent, has tokens again
+        :return: None
+        """
+        pacer = self.__pacer
+        if pacer.get_tokens() <= 0 and self.__send_buffer.has_unsent() and \
+                self.__pacing_scheder is None:
+            self.__pacing_scheder = RxProtocol.schedule(
+                pacer.get_delay(1), self.__resume_pacing)
+
+    def __resume_pacing(self):
+        with self.__send_lock:
+            self.__pacing_scheder = None
+            self.__flush_send(force_ack=False)
+
+    def __retransmit(self, timer_id):
+        with self.__send_lock:
+            if timer_id != self.__rto_timer_id:
+                # the timer was stopped or restarted while it fired
+                return
+            self.__flush_send_scheder = None
+            # the timer expired, wait longer before the next one
+            self.__rto_estimator.rt_update()
+            send_buffer = self.__send_buffer
+            if self.__congestion_control is not None and \
+                    send_buffer is not None:
+                self.__congestion_control.on_timeout(
+                    send_buffer.get_in_flight())
+            self.__flush_send(retransmit=True)
 
     # use this after listen() is invoked
     def __process_passive_open(self, _src_ip, _rcvd_segment):
@@ -309,7 +840,8 @@ class rxpsocket:
         if not client_queue.full() and _rcvd_segment.is_yo():
             src_addr = (_src_ip, _rcvd_segment.get_src_port())
             cond = self.__state_cond
-            if _rcvd_segment.is_ack() and _rcvd_segment.get_ack_num() == \
+            if self.__state == States.YO_RCVD and _rcvd_segment.is_ack() \
+                    and _rcvd_segment.get_ack_num() == \
                     self.__send_buffer.get_next_seq_num() and src_addr == \
                     self.__peer_addr:
                 # Received YO!+ACK segment
@@ -318,10 +850,17 @@ class rxpsocket:
                 self.__send_buffer.notify_ack(_rcvd_segment.get_ack_num())
 
                 # expands the buffer size
-                self.__recv_buffer.commit()
-                self.__send_buffer.commit()
+                self.__recv_buffer.commit(self.__get_recv_buffer_size())
+                self.__send_buffer.commit(self.__send_buffer_size)
                 self.__recv_buffer.sync_ack_num(_rcvd_segment.get_seq_num())
-                client_queue.put(self.__spawn_kid())
+                kiddy = self.__spawn_kid()
+                # the buffers belong to the new socket now, settings made on
+                # the listening socket only apply to the next connections,
+                # so the new socket answers the YO!+ACK itself
+                self.__send_buffer = None
+                self.__recv_buffer = None
+                kiddy.__flush_send()
+                client_queue.put(kiddy)
                 cond.acquire()
                 self.__state = States.LISTEN
                 cond.notify()
@@ -350,15 +889,24 @@ class rxpsocket:
                         dst_port=src_addr[1]
                     )
                     self.__recv_buffer = RecvBuffer()
+                    self.__rto_estimator = RTOEstimator()
 
                     send_buffer = self.__send_buffer
+                    send_buffer.set_rto_estimator(self.__rto_estimator)
                     send_buffer.generate_seq_num()
 
                     # keeptrack of peer window size
                     self.__peer_window_size = _rcvd_segment.get_window_size()
 
+                    # our YO! tells the peer what we agreed on
+                    self.__negotiate(_rcvd_segment)
+
                     self.__state = States.YO_RCVD
-                    self.__send_buffer.put(yo=True)
+                    self.__send_buffer.put(
+                        yo=True,
+                        options=self.__yo_options(
+                            compression=self.__compressor is not None)
+                    )
 
                     # TODO: reflush if we receive unexpected segment!
 
@@ -397,6 +945,22 @@ class rxpsocket:
         kiddy.__recv_buffer = self.__recv_buffer
         kiddy.__send_buffer = self.__send_buffer
         kiddy.__peer_window_size = self.__peer_window_size
+        kiddy.__coalesce_budget = self.__coalesce_budget
+        kiddy.__compression = self.__compression
+        kiddy.__compressor = self.__compressor
+        kiddy.__requested_mss = self.__requested_mss
+        kiddy.__mss = self.__mss
+        kiddy.__ack_delay = self.__ack_delay
+        kiddy.__blocking = self.__blocking
+        kiddy.__nagle = self.__nagle
+        kiddy.__send_buffer_size = self.__send_buffer_size
+        kiddy.__recv_buffer_size = self.__recv_buffer_size
+        kiddy.__recv_window_segments = self.__recv_window_segments
+        kiddy.__pacing = self.__pacing
+        kiddy.__pacing_rate = self.__pacing_rate
+        kiddy.__rto_estimator = self.__rto_estimator
+        kiddy.__congestion_algorithm = self.__congestion_algorithm
+        kiddy.__congestion_control = self.__congestion_control
         kiddy.__inbound_processor = kiddy.__process_data_xchange
         RxProtocol.register(
             socket=kiddy
@@ -418,10 +982,10 @@ class rxpsocket:
             if _rcvd_segment.is_yo():
                 if self.__state == States.YO_SENT:
                     # ACTIVE OPEN: YO_SENT->SYN_YO_ACK_SENT
+                    self.__negotiate(_rcvd_segment)
                     self.__send_buffer.generate_seq_num()
-                    self.__recv_buffer.commit()
-                    self.__send_buffer.commit()
-                    self.__send_buffer.notify_ack(1)
+                    self.__recv_buffer.commit(self.__get_recv_buffer_size())
+                    self.__send_buffer.commit(self.__send_buffer_size)
                     self.__recv_buffer.sync_ack_num(
                         _rcvd_segment.get_seq_num())
                     cond.acquire()
@@ -482,10 +1046,13 @@ class rxpsocket:
     def __process_init_close(self, _src_ip, _rcvd_segment):
         src_addr = (_src_ip, _rcvd_segment.get_src_port())
 
-        if src_addr == self.__peer_addr and self.__recv_buffer.is_expecting(
+        if src_addr == self.__peer_addr and self.__recv_buffer.is_in_window(
                 _rcvd_segment):
+            in_order = self.__recv_buffer.is_expecting(_rcvd_segment)
+
             # allows send buffer to discard acked segments
             self.__send_buffer.notify_ack(_rcvd_segment.get_ack_num())
+            self.__notify_sack(_rcvd_segment)
 
             # keeptrack of peer window size
             self.__peer_window_size = _rcvd_segment.get_window_size()
@@ -500,7 +1067,7 @@ class rxpsocket:
                 cond.notify()
                 cond.release()
 
-            if _rcvd_segment.is_cya():
+            if _rcvd_segment.is_cya() and in_order:
                 # we dont want to accept any more data if CYA bit was set
                 if self.__state == States.CYA_WAIT:
                     self.__state = States.LAST_WAIT
@@ -529,23 +1096,28 @@ class rxpsocket:
             self.__schedule_active_closure_scheder.cancel()
 
         def closure():
+            self.__recv_buffer.release()
             self.__send_buffer = None
             self.__recv_buffer = None
             self.__inbound_processor = lambda src_port, rcvd_segment: None
+            cond = self.__state_cond
+            cond.acquire()
             self.__state = States.CLOSED
+            cond.notify()
+            cond.release()
             RxProtocol.deregister(self)
 
-        self.__schedule_active_closure_scheder = \
-            threading.Timer(LAST_WAIT_DUR_S, closure)
-        self.__schedule_active_closure_scheder.start()
+        self.__schedule_active_closure_scheder = RxProtocol.schedule(
+            LAST_WAIT_DUR_S, closure)
 
     def __process_resp_close(self, _src_ip, _rcvd_segment):
         # there should not be any more data here, since the initiator
         # supposed to already close their send buffer
-        if _rcvd_segment.is_ack() and _rcvd_segment.is_ack_num() == \
+        if _rcvd_segment.is_ack() and _rcvd_segment.get_ack_num() == \
                 self.__send_buffer.get_next_seq_num() and \
                 self.__recv_buffer.is_expecting(
             _rcvd_segment) and self.__state == States.LAST_WORD:
+            self.__recv_buffer.release()
             self.__send_buffer = None
             self.__recv_buffer = None
             self.__inbound_processor = lambda src_port, rcvd_segment: None
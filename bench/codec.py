@@ -0,0 +1,261 @@
+""" Microbenchmarks for the RxP codec and segmentation layer.
+
+No network is needed. Every benchmark reports operations per second, data
+bytes per second and what one operation allocates, and is compared with the
+baseline stored in bench/baseline.json.
+
+Usage (from the repository root):
+    python -m bench.codec                 compare with the baseline
+    python -m bench.codec --save          store the results as the baseline
+    python -m bench.codec --threshold 0.2 fail if 20% slower (default 40%)
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from FxA.util import Util
+from RxP.Packeter import Packeter
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+
+# payload sizes of a single segment, sizes larger than the default MSS are
+# segments of a connection with an MSS as large as the payload
+PAYLOAD_SIZES = (0, 64, 512, 1024, 4096, 16384)
+
+# MSS values packetize splits a bulk buffer with
+PACKETIZE_MSS = (512, 1024, 4096, 16384)
+PACKETIZE_SIZE = 65536
+
+# every benchmark is timed in samples of at least SAMPLE_OPS operations
+# and SAMPLE_TIME_S seconds, for MIN_TIME_S seconds spread over ROUNDS
+# rounds through all benchmarks, and the fastest sample counts. A sample
+# the rest of the system slowed down simply loses, so even operations of a
+# microsecond time reliably
+MIN_TIME_S = 2.0
+ROUNDS = 10
+SAMPLE_OPS = 1000
+SAMPLE_TIME_S = 0.005
+ALLOC_OPS = 100
+
+
+def payload(size):
+    return os.urandom(size)
+
+
+def segment(size):
+    return Packeter.packetize(1, 2, 0, payload(size),
+                              mss=max(Packeter.MSS, size))[0]
+
+
+def case_binarize(size):
+    seg = segment(size)
+    return lambda: Packeter.binarize(seg), size
+
+
+def case_objectize(size):
+    binary = Packeter.binarize(segment(size))
+
+    def op():
+        # get_data forces the lazily sliced data, as a receiver would
+        return Packeter.objectize(binary).get_data()
+    return op, size
+
+
+def case_compute_checksum(size):
+    seg = segment(size)
+    return lambda: Packeter.compute_checksum(seg), size
+
+
+def case_validate_checksum(size):
+    seg = segment(size)
+    return lambda: Packeter.validate_checksum(seg), size
+
+
+def case_restamp(size):
+    seg = segment(size)
+    state = [0]
+
+    def op():
+        state[0] += 1
+        return Packeter.restamp(seg, True, state[0], 1024)
+    return op, size
+
+
+def case_packetize(mss):
+    data = payload(PACKETIZE_SIZE)
+
+    def op():
+        return Packeter.packetize(1, 2, 0, data, mss=mss)
+    return op, PACKETIZE_SIZE
+
+
+def cases():
+    """ Yields name, parameter and case factory of every benchmark """
+    for size in PAYLOAD_SIZES:
+        for name, factory in (('binarize', case_binarize),
+                              ('objectize', case_objectize),
+                              ('compute_checksum', case_compute_checksum),
+                              ('validate_checksum', case_validate_checksum),
+                              ('restamp', case_restamp)):
+            yield '%s/%d' % (name, size), size, factory
+    for mss in PACKETIZE_MSS:
+        yield 'packetize/%d@%d' % (PACKETIZE_SIZE, mss), mss, case_packetize
+
+
+def calibrate(op, min_time):
+    """ Picks the number of ops of a sample, at least SAMPLE_OPS and more
+    for ops so fast that the clock would not resolve them
+    :return: the number of ops
+    """
+    batch = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= SAMPLE_TIME_S:
+            break
+        batch *= 2
+    if batch < SAMPLE_OPS and elapsed * SAMPLE_OPS / batch < min_time / 10:
+        batch = SAMPLE_OPS
+    return batch
+
+
+def sample(op, batch, duration):
+    """ Times batches of op until duration passed
+    :return: the seconds the fastest batch took
+    """
+    fastest = float('inf')
+    deadline = time.perf_counter() + duration
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            op()
+        end = time.perf_counter()
+        fastest = min(fastest, end - start)
+        if end >= deadline:
+            return fastest
+
+
+def allocations(op):
+    """ Counts what op allocates
+    :return: live blocks one op leaves behind, and the peak bytes it
+    allocates
+    """
+    # results are kept alive so what an op leaves behind can be counted
+    tracemalloc.start()
+    kept = []
+    before = tracemalloc.take_snapshot()
+    for _ in range(ALLOC_OPS):
+        kept.append(op())
+    after = tracemalloc.take_snapshot()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before,
+                                                              'filename'))
+    kept = None
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    op()
+    peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return max(blocks - 1, 0) / ALLOC_OPS, peak
+
+
+def run(min_time, name_filter=None):
+    """ Samples every benchmark in ROUNDS rounds, so a slow stretch of the
+    system does not hit all the samples of one benchmark
+    :return: dict of name to ops per second, bytes per second, live blocks
+    left behind and peak bytes allocated by one op
+    """
+    benchmarks = []
+    for name, param, factory in cases():
+        if name_filter and name_filter not in name:
+            continue
+        op, nbytes = factory(param)
+        benchmarks.append((name, op, nbytes, calibrate(op, min_time)))
+    fastest = {}
+    for _ in range(ROUNDS):
+        for name, op, _, batch in benchmarks:
+            fastest[name] = min(fastest.get(name, float('inf')),
+                                sample(op, batch, min_time / ROUNDS))
+    results = {}
+    for name, op, nbytes, batch in benchmarks:
+        ops_per_sec = batch / fastest[name]
+        blocks, peak = allocations(op)
+        results[name] = {
+            'ops_per_sec': ops_per_sec,
+            'bytes_per_sec': ops_per_sec * nbytes,
+            'blocks_per_op': blocks,
+            'peak_bytes_per_op': peak
+        }
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    line = '%-32s %12.0f ops/s %10.2f MB/s %8.1f blocks/op %9d peak B/op' % (
+        name, result['ops_per_sec'], result['bytes_per_sec'] / 1e6,
+        result['blocks_per_op'], result['peak_bytes_per_op'])
+    print(line)
+    sys.stdout.flush()
+
+
+def compare(results, baseline, threshold):
+    """ Compares results with the baseline
+    :return: the names of the benchmarks that regressed beyond threshold
+    """
+    regressed = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['ops_per_sec'] / base['ops_per_sec']
+        mark = ''
+        if ratio < 1 - threshold:
+            regressed.append(name)
+            mark = '  REGRESSION'
+        print('%-32s %6.2fx baseline%s' % (name, ratio, mark))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RxP codec benchmarks')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.4,
+                        help='fraction of slow down that fails the run')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME_S,
+                        help='seconds each benchmark is sampled for')
+    parser.add_argument('--filter', default=None,
+                        help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    Util.setup_logger().setLevel(logging.ERROR)
+    results = run(args.min_time, args.filter)
+
+    if args.save:
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('baseline saved to ' + BASELINE_FILE)
+        return 0
+
+    if not os.path.exists(BASELINE_FILE):
+        print('no baseline, run with --save to create one')
+        return 0
+    with open(BASELINE_FILE) as baseline_file:
+        baseline = json.load(baseline_file)
+    print()
+    regressed = compare(results, baseline, args.threshold)
+    if regressed:
+        print('%d benchmark(s) regressed more than %d%%' % (
+            len(regressed), args.threshold * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
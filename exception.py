@@ -42,7 +42,8 @@ class RxPException(Exception):
         105: 'Socket already bound.',
         106: 'Socket is in use (socket still active).',
         107: 'Connection force closed by peer.',
-        108: 'Invalid state.'
+        108: 'Invalid state.',
+        109: 'Operation would block (send buffer is full).'
     }
 
     def __init__(self, errno):
@@ -0,0 +1,43 @@
+import os
+import unittest
+
+from RxP.Compressor import Compressor
+
+
+class CompressorTest(unittest.TestCase):
+    def setUp(self):
+        self.compressor = Compressor()
+
+    def test_roundtrip(self):
+        data = b'hello world, this is RxP test data ' * 30
+        zipped = self.compressor.deflate(data)
+        self.assertLess(len(zipped), len(data))
+        self.assertEqual(Compressor.inflate(zipped, len(data)), data)
+
+    def test_small_segments_are_sent_as_is(self):
+        self.assertIsNone(self.compressor.deflate(
+            b'a' * (Compressor.MIN_SIZE - 1)))
+
+    def test_inflate_rejects_bad_or_too_large_data(self):
+        data = b'a' * 1000
+        zipped = self.compressor.deflate(data)
+        self.assertIsNone(Compressor.inflate(zipped, len(data) - 1))
+        self.assertIsNone(Compressor.inflate(zipped[:-2], len(data)))
+        self.assertIsNone(Compressor.inflate(b'not zlib', len(data)))
+
+    def test_bypassed_for_incompressible_data(self):
+        sent = 0
+        # the average ratio goes past POOR_RATIO after a few segments
+        while self.compressor.get_ratio() or not sent:
+            self.assertIsNone(self.compressor.deflate(os.urandom(1000)))
+            sent += 1
+            self.assertLess(sent, 20)
+        # compression is then off for a while, even for data that would
+        # compress well
+        for _ in range(Compressor.BYPASS_SEGMENTS):
+            self.assertIsNone(self.compressor.deflate(b'a' * 1000))
+        self.assertIsNotNone(self.compressor.deflate(b'a' * 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import types
+import unittest
+from unittest import mock
+
+from RxP import Cubic as cubic_module
+from RxP.CongestionControl import CongestionControl
+from RxP.Cubic import Cubic
+from RxP.NewReno import NewReno
+
+MSS = 1000
+
+
+class NewRenoTest(unittest.TestCase):
+    def setUp(self):
+        self.cc = NewReno(MSS)
+
+    def test_cannot_be_created_without_avoidance(self):
+        with self.assertRaises(TypeError):
+            CongestionControl(MSS)
+
+    def test_slow_start(self):
+        self.assertEqual(self.cc.get_congestion_window(),
+                         CongestionControl.INITIAL_WINDOW * MSS)
+        self.assertTrue(self.cc.is_slow_start())
+        # at most one MSS per ACK
+        self.cc.on_ack(3 * MSS)
+        self.cc.on_ack(MSS // 2)
+        self.assertEqual(self.cc.get_congestion_window(), 11.5 * MSS)
+
+    def test_timeout(self):
+        self.cc.on_timeout(40 * MSS)
+        self.assertEqual(self.cc.get_congestion_window(), MSS)
+        self.assertTrue(self.cc.is_slow_start())
+        self.cc.on_timeout(MSS)
+        # the threshold never drops below the minimum window
+        for _ in range(CongestionControl.MIN_WINDOW):
+            self.cc.on_ack(MSS)
+        self.assertFalse(self.cc.is_slow_start())
+
+    def test_congestion_avoidance_grows_one_segment_per_window(self):
+        self.cc.on_timeout(40 * MSS)
+        for _ in range(19):
+            self.cc.on_ack(MSS)
+        self.assertEqual(self.cc.get_congestion_window(), 20 * MSS)
+        self.assertFalse(self.cc.is_slow_start())
+        for _ in range(20):
+            self.cc.on_ack(MSS)
+        self.assertAlmostEqual(self.cc.get_congestion_window() / MSS, 21,
+                               delta=0.1)
+
+    def test_fast_recovery(self):
+        self.cc.on_loss(20 * MSS)
+        # half the flight, inflated by the three duplicate ACKs
+        self.assertEqual(self.cc.get_congestion_window(), 13 * MSS)
+        self.cc.on_dup_ack()
+        self.assertEqual(self.cc.get_congestion_window(), 14 * MSS)
+        self.cc.on_partial_ack(5 * MSS)
+        self.assertEqual(self.cc.get_congestion_window(), 10 * MSS)
+        self.cc.on_recovery_exit()
+        self.assertEqual(self.cc.get_congestion_window(), 10 * MSS)
+        self.assertFalse(self.cc.is_slow_start())
+
+
+class CubicTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch.object(cubic_module, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cc = Cubic(MSS)
+        self.cc.on_rtt_sample(0.1)
+
+    def window(self):
+        return self.cc.get_congestion_window() / MSS
+
+    def lose_at(self, segments):
+        self.cc._congestion_window = segments * MSS
+        self.cc.on_loss(segments * MSS)
+        self.cc.on_recovery_exit()
+
+    def ack_window(self, windows=1):
+        for _ in range(windows):
+            for _ in range(int(self.window())):
+                self.cc.on_ack(MSS)
+
+    def test_multiplicative_decrease(self):
+        self.lose_at(100)
+        self.assertAlmostEqual(self.window(), 100 * Cubic.BETA, delta=0.01)
+        self.assertFalse(self.cc.is_slow_start())
+
+    def test_window_follows_the_cubic_curve(self):
+        self.lose_at(100)
+        self.cc.on_ack(MSS)
+        k = (100 * (1 - Cubic.BETA) / Cubic.C) ** (1 / 3)
+        # concave up to the window of the loss
+        self.now += k / 2
+        self.ack_window(3)
+        self.assertGreater(self.window(), 90)
+        self.assertLess(self.window(), 100)
+        # plateau around it
+        self.now += k / 2
+        self.ack_window(3)
+        self.assertAlmostEqual(self.window(), 100, delta=1)
+        # then probes past it, convex
+        self.now += 3
+        self.ack_window(3)
+        self.assertGreater(self.window(), 103)
+
+    def test_fast_convergence(self):
+        self.lose_at(100)
+        # a loss below the last maximum gives way to newer flows, the
+        # window then levels off below the window of that loss
+        self.lose_at(80)
+        self.cc.on_ack(MSS)
+        k = ((80 * (1 + Cubic.BETA) / 2 - 80 * Cubic.BETA) / Cubic.C) ** \
+            (1 / 3)
+        self.now += k
+        self.ack_window(5)
+        self.assertLess(self.window(), 75)
+
+    def test_never_slower_than_reno(self):
+        self.lose_at(100)
+        self.cc.on_ack(MSS)
+        # no time passes, the cubic curve stays near 72 segments while
+        # the Reno estimate gains about half a segment per window
+        self.ack_window(20)
+        self.assertGreater(self.window(), 78)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+
+from RxP.Dispatcher import Dispatcher
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher(workers=1, depth=4, max_bytes=100)
+        # the worker waits on the first task, the rest stay queued
+        self.running = threading.Event()
+        self.go = threading.Event()
+        self.assertTrue(self.dispatcher.submit(
+            'key', lambda: (self.running.set(), self.go.wait()), size=10))
+        self.running.wait()
+
+    def tearDown(self):
+        self.go.set()
+
+    def drain(self):
+        self.go.set()
+        done = threading.Event()
+        while not self.dispatcher.submit('key', done.set):
+            time.sleep(0.01)
+        done.wait()
+        # the worker counts a task out once it returned
+        while self.dispatcher.get_stats()['pending_bytes']:
+            time.sleep(0.01)
+
+    def test_runs_tasks_of_a_key_in_order(self):
+        ran = []
+        for i in range(4):
+            self.dispatcher.submit('key', lambda i=i: ran.append(i))
+        self.drain()
+        self.assertEqual(ran, [0, 1, 2, 3])
+
+    def test_refuses_beyond_depth(self):
+        for _ in range(4):
+            self.assertTrue(self.dispatcher.submit('key', lambda: None))
+        self.assertFalse(self.dispatcher.submit('key', lambda: None))
+        self.assertEqual(self.dispatcher.get_stats()['refused'], 1)
+
+    def test_refuses_beyond_max_bytes(self):
+        self.assertTrue(self.dispatcher.submit('key', lambda: None, size=80))
+        self.assertFalse(self.dispatcher.submit('key', lambda: None,
+                                                size=20))
+        self.assertTrue(self.dispatcher.submit('key', lambda: None, size=10))
+        self.assertEqual(self.dispatcher.get_stats()['pending_bytes'], 100)
+        self.drain()
+        self.assertEqual(self.dispatcher.get_stats()['pending_bytes'], 0)
+
+    def test_queues_a_large_task_on_an_idle_worker(self):
+        self.drain()
+        self.assertTrue(self.dispatcher.submit('key', lambda: None,
+                                               size=1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Both ends run in one process, every datagram goes out to the UDP port of
+# the process itself. The network thread never exits, so the script leaves
+# with os._exit()
+SCRIPT = textwrap.dedent("""
+    import hashlib
+    import os
+    import sys
+    import threading
+
+    from RxP.rxpsocket import rxpsocket
+
+    udp_port, clients, size = (int(arg) for arg in sys.argv[1:])
+    rxpsocket.initial_setup(udp_port, ('127.0.0.1', udp_port))
+    listener = rxpsocket()
+    listener.bind(('', 8000))
+    listener.listen(clients)
+
+    received = {}
+    start = threading.Barrier(clients)
+
+    def serve():
+        connection, _ = listener.accept()
+        data = bytearray()
+        while len(data) < size:
+            data += connection.recv(size)
+        received[bytes(data[:8])] = hashlib.md5(data).hexdigest()
+
+    def connect(i):
+        data = (b'%08d' % i) * (size // 8)
+        connection = rxpsocket()
+        start.wait()
+        connection.connect(('127.0.0.1', 8000))
+        connection.sendall(data)
+        return hashlib.md5(data).hexdigest()
+
+    sent = {}
+    threads = [threading.Thread(target=serve) for _ in range(clients)]
+    threads += [threading.Thread(
+        target=lambda i=i: sent.__setitem__(b'%08d' % i, connect(i)))
+        for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sys.stdout.write('ok\\n' if sent == received else 'mismatch\\n')
+    sys.stdout.flush()
+    os._exit(0)
+""")
+
+
+CLOSE_SCRIPT = textwrap.dedent("""
+    import os
+    import sys
+    import threading
+    import time
+
+    import RxP.rxpsocket
+    from RxP.RecvBuffer import RecvBuffer
+    from RxP.rxpsocket import rxpsocket
+
+    RxP.rxpsocket.LAST_WAIT_DUR_S = 0.1
+    udp_port = int(sys.argv[1])
+    rxpsocket.initial_setup(udp_port, ('127.0.0.1', udp_port))
+    listener = rxpsocket()
+    listener.bind(('', 8000))
+    listener.listen(1)
+    accepted = []
+    thread = threading.Thread(
+        target=lambda: accepted.append(listener.accept()[0]))
+    thread.start()
+    client = rxpsocket()
+    client.connect(('127.0.0.1', 8000))
+    thread.join()
+    server = accepted[0]
+    reserved = RecvBuffer.get_reserved()
+    # only the next connections of the listening socket get the window
+    listener.set_recv_window(4)
+    checks = [RecvBuffer.get_reserved() == reserved]
+    closer = threading.Thread(target=client.close)
+    closer.start()
+    # the server closes once the CYA of the client arrived
+    time.sleep(1)
+    server.close()
+    closer.join()
+    checks.append(RecvBuffer.get_reserved() == 0)
+    sys.stdout.write('%s\\n' % checks)
+    sys.stdout.flush()
+    os._exit(0)
+""")
+
+
+def free_udp_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def run(script, *args):
+    return subprocess.run(
+        [sys.executable, '-c', script, str(free_udp_port())] +
+        [str(arg) for arg in args],
+        cwd=ROOT, capture_output=True, text=True, timeout=60)
+
+
+class ListenerTest(unittest.TestCase):
+    def test_concurrent_connections(self):
+        result = run(SCRIPT, 4, 64 * 1024)
+        self.assertEqual(result.stdout.strip(), 'ok', result.stderr[-2000:])
+
+    def test_close_gives_the_windows_back(self):
+        result = run(CLOSE_SCRIPT)
+        self.assertEqual(result.stdout.strip(), '[True, True]',
+                         result.stderr[-2000:])
+
+
+if __name__ == '__main__':
+    unittest.main()
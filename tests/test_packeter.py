@@ -0,0 +1,100 @@
+import random
+import unittest
+
+# rxpsocket first, the buffers import it back
+from RxP.rxpsocket import rxpsocket
+from RxP.Packeter import Packeter
+
+
+def reference_sum(data):
+    """ The one's complement sum of RFC 1071, a word at a time """
+    if len(data) % 2:
+        data += b'\x00'
+    total = 0
+    for i in range(0, len(data), 2):
+        total += (data[i] << 8) | data[i + 1]
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+class PacketerTest(unittest.TestCase):
+    def roundtrip(self, segment):
+        binary = Packeter.binarize(segment)
+        return Packeter.objectize(memoryview(binary))
+
+    def test_data_segment_roundtrip(self):
+        data = bytes(range(256)) * 5
+        segment = Packeter.packetize(src_port=1, dst_port=2, seq_num=7,
+                                     data=data, mss=len(data))[0]
+        Packeter.restamp(segment, ack=True, ack_num=99, window_size=4096)
+        copy = self.roundtrip(segment)
+        self.assertEqual((copy.get_src_port(), copy.get_dst_port(),
+                          copy.get_seq_num(), copy.get_ack_num(),
+                          copy.get_window_size(), copy.get_checksum()),
+                         (1, 2, 7, 99, 4096, segment.get_checksum()))
+        self.assertTrue(copy.is_ack())
+        self.assertFalse(copy.is_yo() or copy.is_cya())
+        self.assertEqual(bytes(copy.get_data()), data)
+
+    def test_control_segment_with_options_roundtrip(self):
+        options = {Packeter.OPT_MSS: 1400, Packeter.OPT_COMPRESS: 1,
+                   Packeter.OPT_SACK: [(10, 20), (30, 40)]}
+        segment = Packeter.control_packet(
+            src_port=65535, dst_port=1, seq_num=Packeter.MAX_SEQ_NUM - 1,
+            ack_num=5, yo=True, cya=True, ack=True, options=options)
+        copy = self.roundtrip(segment)
+        self.assertTrue(copy.is_yo() and copy.is_cya() and copy.is_ack())
+        self.assertEqual(copy.get_seq_num(), Packeter.MAX_SEQ_NUM - 1)
+        self.assertEqual(copy.get_options(), options)
+        self.assertEqual(bytes(copy.get_data() or b''), b'')
+
+    def test_header_layout(self):
+        segment = Packeter.control_packet(src_port=1, dst_port=2, seq_num=3)
+        binary = Packeter.binarize(segment)
+        self.assertEqual(len(binary), Packeter.HEADER.size)
+        self.assertEqual(binary[0], Packeter.VERSION)
+        self.assertEqual(Packeter.peek_ports(binary), (1, 2))
+
+    def test_rejects_malformed_binaries(self):
+        segment = Packeter.packetize(src_port=1, dst_port=2, seq_num=0,
+                                     data=b'hello')[0]
+        binary = bytearray(Packeter.binarize(segment))
+        self.assertIsNone(Packeter.objectize(binary[:-1]))
+        self.assertIsNone(Packeter.objectize(binary[:10]))
+        # a peer still talking the text format of version 1
+        binary[0] = 1
+        self.assertIsNone(Packeter.objectize(binary))
+
+    def test_word_sum_matches_rfc_1071(self):
+        rng = random.Random(3)
+        for size in (0, 1, 2, 3, 64, 1023):
+            data = bytes(rng.getrandbits(8) for _ in range(size))
+            self.assertEqual(Packeter.word_sum(data), reference_sum(data))
+        self.assertEqual(Packeter.word_sum(b'\xff\xff' * 3), 0xffff)
+
+    def test_checksum_detects_corruption(self):
+        segment = Packeter.packetize(src_port=1, dst_port=2, seq_num=0,
+                                     data=b'some data')[0]
+        self.assertTrue(Packeter.validate_checksum(segment))
+        binary = bytearray(Packeter.binarize(segment))
+        binary[-1] ^= 0x01
+        self.assertFalse(Packeter.validate_checksum(
+            Packeter.objectize(binary)))
+
+    def test_restamp_updates_the_checksum_incrementally(self):
+        data = bytes(random.Random(5).getrandbits(8) for _ in range(1000))
+        segment = Packeter.packetize(src_port=1, dst_port=2, seq_num=0,
+                                     data=data, mss=len(data))[0]
+        for ack_num, window, sack in ((1, 100, None),
+                                      (70000, 0, [(5, 9)]),
+                                      (3, 65535, None)):
+            Packeter.restamp(segment, ack=True, ack_num=ack_num,
+                             window_size=window, sack_blocks=sack)
+            self.assertTrue(Packeter.validate_checksum(segment))
+            checksum = segment.get_checksum()
+            self.assertEqual(
+                Packeter.compute_checksum(segment).get_checksum(), checksum)
+
+
+if __name__ == '__main__':
+    unittest.main()
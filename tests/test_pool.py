@@ -0,0 +1,29 @@
+import unittest
+
+from RxP.Pool import Pool
+
+
+class PoolTest(unittest.TestCase):
+    def test_reuses_released_objects(self):
+        pool = Pool(factory=list, capacity=2, reset=list.clear)
+        first = pool.acquire()
+        first.append(1)
+        pool.release(first)
+        again = pool.acquire()
+        self.assertIs(again, first)
+        self.assertEqual(again, [])
+        self.assertEqual(pool.get_hit_rate(), 0.5)
+
+    def test_discards_beyond_capacity(self):
+        pool = Pool(factory=object, capacity=1)
+        objects = [pool.acquire() for _ in range(3)]
+        for obj in objects:
+            pool.release(obj)
+        stats = pool.get_stats()
+        self.assertEqual((stats['free'], stats['discards']), (1, 2))
+        self.assertIn(pool.acquire(), objects)
+        self.assertEqual(pool.get_stats()['free'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import random
+import unittest
+
+# rxpsocket first, the buffers import it back
+from RxP.rxpsocket import rxpsocket
+from RxP.Packeter import Packeter
+from RxP.RecvBuffer import RecvBuffer
+
+MAX_SEQ_NUM = Packeter.MAX_SEQ_NUM
+
+
+def segment(seq_num, data):
+    return Packeter.packetize(src_port=1, dst_port=2, seq_num=seq_num,
+                              data=memoryview(data), mss=len(data))[0]
+
+
+class RecvBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = RecvBuffer()
+        self.buffer.commit()
+        # the YO! of the peer took sequence number 99
+        self.buffer.sync_ack_num(99)
+
+    def tearDown(self):
+        self.buffer.release()
+
+    def put(self, offset, data, first=100):
+        self.buffer.put(segment((first + offset) % MAX_SEQ_NUM, data))
+
+    def test_in_order(self):
+        self.put(0, b'hello ')
+        self.put(6, b'world')
+        self.assertEqual(self.buffer.get_expected_seq_num(), 111)
+        self.assertEqual(self.buffer.take(100), b'hello world')
+
+    def test_reassembles_shuffled_overlapping_fragments(self):
+        data = bytes(random.Random(1).getrandbits(8) for _ in range(2000))
+        pieces = []
+        for start in range(0, len(data), 50):
+            # every piece overlaps the next one
+            pieces.append((start, data[start:start + 80]))
+        random.Random(2).shuffle(pieces)
+        for start, piece in pieces:
+            self.put(start, piece)
+        self.assertFalse(self.buffer.has_out_of_order())
+        self.assertEqual(self.buffer.get_expected_seq_num(), 100 + len(data))
+        self.assertEqual(self.buffer.take(len(data)), data)
+
+    def test_wraps_around_the_sequence_space(self):
+        first = MAX_SEQ_NUM - 8
+        self.buffer.sync_ack_num(first - 1)
+        data = bytes(range(40))
+        for start in (30, 10, 20, 0):
+            self.put(start, data[start:start + 10], first=first)
+        self.assertEqual(self.buffer.get_expected_seq_num(), 32)
+        self.assertEqual(self.buffer.take(100), data)
+
+    def test_trims_data_to_the_window(self):
+        self.buffer.set_max_size(8)
+        self.put(0, b'0123456789')
+        self.assertEqual(self.buffer.get_expected_seq_num(), 108)
+        self.assertEqual(self.buffer.get_window_size(), 0)
+        self.assertEqual(self.buffer.take(100), b'01234567')
+
+    def test_resent_data_only_delivers_what_is_new(self):
+        self.put(0, b'abcd')
+        self.put(2, b'cdef')
+        self.assertEqual(self.buffer.take(100), b'abcdef')
+
+    def test_sack_blocks_merge_contiguous_chunks(self):
+        self.put(10, b'x' * 10)
+        self.put(20, b'x' * 10)
+        self.put(40, b'x' * 5)
+        self.assertEqual(self.buffer.get_sack_blocks(),
+                         [(110, 130), (140, 145)])
+        self.put(0, b'x' * 10)
+        self.assertEqual(self.buffer.get_sack_blocks(), [(140, 145)])
+
+    def test_sack_blocks_are_capped(self):
+        for i in range(Packeter.MAX_SACK_BLOCKS + 2):
+            self.put(10 + 20 * i, b'x' * 10)
+        blocks = self.buffer.get_sack_blocks()
+        self.assertEqual(len(blocks), Packeter.MAX_SACK_BLOCKS)
+        self.assertEqual(blocks[0], (110, 120))
+
+    def test_is_in_window(self):
+        self.put(0, b'abcd')
+        self.assertTrue(self.buffer.is_in_window(segment(104, b'e')))
+        self.assertTrue(self.buffer.is_in_window(segment(200, b'e')))
+        # starts behind the expected byte but brings new data
+        self.assertTrue(self.buffer.is_in_window(segment(102, b'cde')))
+        self.assertFalse(self.buffer.is_in_window(segment(100, b'ab')))
+        self.assertFalse(self.buffer.is_in_window(
+            segment(104 + self.buffer.get_window_size(), b'e')))
+
+    def test_partial_reads(self):
+        self.put(0, b'hello ')
+        self.put(6, b'world')
+        self.assertEqual(self.buffer.take(3), b'hel')
+        target = bytearray(5)
+        self.assertEqual(self.buffer.take_into(target), 5)
+        self.assertEqual(target, b'lo wo')
+        self.assertEqual(self.buffer.take(100), b'rld')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from RxP.RTOEstimator import RTOEstimator
+
+
+class RTOEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.estimator = RTOEstimator()
+
+    def test_initial_rto(self):
+        self.assertEqual(self.estimator.get_rto_interval(),
+                         RTOEstimator.INITIAL_RTO)
+        self.assertIsNone(self.estimator.get_estimated_rtt())
+
+    def test_first_sample(self):
+        # SRTT = R, RTTVAR = R/2, RTO = SRTT + 4 * RTTVAR
+        self.estimator.update_rto_interval(0.5)
+        self.assertEqual(self.estimator.get_estimated_rtt(), 0.5)
+        self.assertAlmostEqual(self.estimator.get_rto_interval(), 1.5)
+
+    def test_later_samples(self):
+        self.estimator.update_rto_interval(0.5)
+        self.estimator.update_rto_interval(1.0)
+        # RTTVAR = 3/4 * 0.25 + 1/4 * 0.5, SRTT = 7/8 * 0.5 + 1/8 * 1.0
+        self.assertAlmostEqual(self.estimator.get_estimated_rtt(), 0.5625)
+        self.assertAlmostEqual(self.estimator.get_rto_interval(),
+                               0.5625 + 4 * 0.3125)
+
+    def test_bounds(self):
+        self.estimator.update_rto_interval(0.001)
+        self.assertEqual(self.estimator.get_rto_interval(),
+                         RTOEstimator.MIN_RTO)
+        self.estimator = RTOEstimator()
+        self.estimator.update_rto_interval(100)
+        self.assertEqual(self.estimator.get_rto_interval(),
+                         RTOEstimator.MAX_RTO)
+
+    def test_backoff(self):
+        self.estimator.update_rto_interval(0.5)
+        self.estimator.rt_update()
+        self.estimator.rt_update()
+        self.assertAlmostEqual(self.estimator.get_rto_interval(), 6.0)
+        for _ in range(10):
+            self.estimator.rt_update()
+        self.assertEqual(self.estimator.get_rto_interval(),
+                         RTOEstimator.MAX_RTO)
+        self.estimator.reset_backoff()
+        self.assertAlmostEqual(self.estimator.get_rto_interval(), 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
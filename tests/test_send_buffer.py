@@ -0,0 +1,130 @@
+import unittest
+
+# rxpsocket first, the buffers import it back
+from RxP.rxpsocket import rxpsocket
+from RxP.Compressor import Compressor
+from RxP.SendBuffer import SendBuffer
+
+MSS = 10
+
+
+class RecordingEstimator:
+    def __init__(self):
+        self.samples = []
+
+    def update_rto_interval(self, sample_rtt):
+        self.samples.append(sample_rtt)
+
+    def reset_backoff(self):
+        pass
+
+
+class SendBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = SendBuffer(src_port=1, dst_port=2)
+        self.buffer.set_mss(MSS)
+        self.buffer.commit(1 << 20)
+
+    def put(self, size):
+        self.assertEqual(self.buffer.put(data=memoryview(bytes(size))), size)
+
+    def take(self, max_bytes=1 << 20, retransmit=False, corked=False):
+        segments = self.buffer.take(ack=True, ack_num=0, self_rcv_wind_size=0,
+                                    max_bytes=max_bytes,
+                                    retransmit=retransmit, force_ack=False,
+                                    corked=corked)
+        return [segment.get_seq_num() for segment in segments]
+
+    def test_takes_what_fits_in_the_window(self):
+        self.put(100)
+        self.assertEqual(self.take(max_bytes=30), [0, 10, 20])
+        self.assertEqual(self.buffer.get_in_flight(), 30)
+        self.assertEqual(self.take(max_bytes=50), [30, 40])
+        self.assertTrue(self.buffer.has_unsent())
+
+    def test_ack_across_compaction(self):
+        count = 3 * SendBuffer.COMPACT_THRESHOLD
+        self.put(count * MSS)
+        self.assertEqual(len(self.take()), count)
+        # the ACK retires more than COMPACT_THRESHOLD segments and ends in
+        # the middle of a segment
+        acked = (count // 2) * MSS + 5
+        self.assertEqual(self.buffer.notify_ack(acked), acked)
+        self.assertEqual(self.buffer.get_unacked_seq_num(), acked)
+        self.assertEqual(self.buffer.get_in_flight(), count * MSS - acked)
+        # an old ACK changes nothing
+        self.assertEqual(self.buffer.notify_ack(acked - 100), 0)
+        self.assertEqual(self.buffer.notify_ack(count * MSS), count * MSS -
+                         acked)
+        self.assertEqual(self.buffer.get_in_flight(), 0)
+        self.assertEqual(self.buffer.get_buffered(), 0)
+
+    def test_sack_after_compaction(self):
+        count = 3 * SendBuffer.COMPACT_THRESHOLD
+        self.put(count * MSS)
+        self.take()
+        head = (count // 2) * MSS
+        self.buffer.notify_ack(head + 3)
+        # the first block only covers the tail of the oldest segment, the
+        # second one a whole segment
+        self.buffer.notify_sack([(head + 6, head + 10),
+                                 (head + 20, head + 30)])
+        resent = self.take(max_bytes=40, retransmit=True)
+        self.assertEqual(resent, [head, head + 10, head + 30])
+
+    def test_timeout_rewinds_to_the_oldest_unacked_segment(self):
+        self.put(50)
+        self.take()
+        self.buffer.notify_ack(20)
+        self.assertEqual(self.take(max_bytes=10, retransmit=True), [20])
+        # the rest follows as the window grows, and is not resent twice
+        self.assertEqual(self.take(max_bytes=30), [30, 40])
+        self.assertEqual(self.take(max_bytes=30), [])
+
+    def test_sack_wholly_covering_segments(self):
+        self.put(100)
+        self.take()
+        self.buffer.notify_sack([(30, 60)])
+        self.assertEqual(self.take(max_bytes=80, retransmit=True),
+                         [0, 10, 20, 60, 70])
+
+    def test_resends_sack_holes_once_in_recovery(self):
+        self.put(100)
+        self.take()
+        self.buffer.notify_ack(10)
+        self.buffer.notify_sack([(30, 50), (60, 70)])
+        self.assertTrue(self.buffer.enter_recovery())
+        self.assertEqual(self.take(), [10, 20, 50])
+        self.assertEqual(self.take(), [])
+        self.buffer.notify_ack(100)
+        self.assertFalse(self.buffer.is_in_recovery())
+
+    def test_cork_holds_back_a_short_tail(self):
+        self.put(25)
+        self.assertEqual(self.take(corked=True), [0, 10])
+        self.put(5)
+        self.assertEqual(self.take(corked=True), [20])
+
+    def test_cork_does_not_hold_back_a_compressed_tail(self):
+        self.buffer.set_mss(1000)
+        self.buffer.set_compressor(Compressor())
+        # short of the MSS, but compressed segments are never topped up
+        self.buffer.put(data=memoryview(b'a' * 500))
+        self.assertEqual(self.take(corked=True), [0])
+
+    def test_resent_segments_are_not_sampled(self):
+        estimator = RecordingEstimator()
+        self.buffer.set_rto_estimator(estimator)
+        self.put(30)
+        self.take()
+        self.take(retransmit=True)
+        self.buffer.notify_ack(30)
+        self.assertEqual(estimator.samples, [])
+        self.put(10)
+        self.take()
+        self.buffer.notify_ack(40)
+        self.assertEqual(len(estimator.samples), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import threading
+import time
+import unittest
+
+from RxP.TimerWheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        # 8 slots of 10 ms, one turn of the wheel takes 80 ms
+        self.wheel = TimerWheel(resolution=0.01, size=8)
+
+    def test_fires_in_order_of_expiry(self):
+        fired = []
+        done = threading.Event()
+        self.wheel.schedule(0.05, lambda: fired.append(2))
+        self.wheel.schedule(0.01, lambda: fired.append(1))
+        self.wheel.schedule(0.1, lambda: (fired.append(3), done.set()))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(fired, [1, 2, 3])
+        self.assertEqual(self.wheel.get_pending(), 0)
+
+    def test_does_not_fire_early(self):
+        fired = threading.Event()
+        start = time.monotonic()
+        self.wheel.schedule(0.05, fired.set)
+        self.assertTrue(fired.wait(2))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_timer_longer_than_a_turn(self):
+        fired = threading.Event()
+        start = time.monotonic()
+        # lands in the slot of a timer that expires a turn earlier
+        self.wheel.schedule(0.01, lambda: None)
+        self.wheel.schedule(0.09, fired.set)
+        self.assertFalse(fired.wait(0.05))
+        self.assertTrue(fired.wait(2))
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_cancel(self):
+        fired = threading.Event()
+        done = threading.Event()
+        handle = self.wheel.schedule(0.02, fired.set)
+        self.wheel.schedule(0.05, done.set)
+        handle.cancel()
+        self.assertEqual(self.wheel.get_pending(), 1)
+        self.assertTrue(done.wait(2))
+        self.assertFalse(fired.is_set())
+        # cancelling a timer that is gone does nothing
+        handle.cancel()
+        self.assertEqual(self.wheel.get_pending(), 0)
+
+    def test_callback_may_schedule_and_survives_errors(self):
+        done = threading.Event()
+
+        def fail():
+            raise ValueError('callback failed')
+
+        self.wheel.schedule(0.01, fail)
+        self.wheel.schedule(0.02, lambda: self.wheel.schedule(0.01, done.set))
+        self.assertTrue(done.wait(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import types
+import unittest
+from unittest import mock
+
+from RxP import TokenBucket as token_bucket_module
+from RxP.TokenBucket import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch.object(token_bucket_module, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 1000 bytes per second, bursts of 500 bytes
+        self.bucket = TokenBucket(1000, 500)
+
+    def test_starts_full_and_refills_up_to_the_burst(self):
+        self.assertEqual(self.bucket.get_tokens(), 500)
+        self.bucket.consume(400)
+        self.now += 0.1
+        self.assertAlmostEqual(self.bucket.get_tokens(), 200)
+        self.now += 10
+        self.assertEqual(self.bucket.get_tokens(), 500)
+
+    def test_debt_is_paid_back_first(self):
+        self.bucket.consume(800)
+        self.assertEqual(self.bucket.get_tokens(), -300)
+        self.assertAlmostEqual(self.bucket.get_delay(100), 0.4)
+        self.now += 0.4
+        self.assertAlmostEqual(self.bucket.get_tokens(), 100)
+        self.assertEqual(self.bucket.get_delay(100), 0)
+
+    def test_set_rate_keeps_the_tokens(self):
+        self.bucket.consume(500)
+        self.now += 0.2
+        self.bucket.set_rate(2000, 1000)
+        self.assertAlmostEqual(self.bucket.get_tokens(), 200)
+        self.now += 0.1
+        self.assertAlmostEqual(self.bucket.get_tokens(), 400)
+        # a smaller burst drops what is above it
+        self.bucket.set_rate(2000, 100)
+        self.assertEqual(self.bucket.get_tokens(), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()